@@ -15,7 +15,7 @@ import random
 import string
 
 # from common_library
-from libs.commonlib.db_insist import get_db , set_graph_changed
+from libs.commonlib.db_insist import get_db
 from libs.commonlib.pymongo_paginated_cursor import PaginatedCursor as mpcur
 from libs.commonlib.graph_funcs import mark_pickup_relationship , set_last_calced_BuyRequest , remove_reservation , \
     remove_staged_sell , remove_travel_to_pickup , remove_travel_to_deliver , remove_staged_driver , \
@@ -26,6 +26,7 @@ from libs.commonlib.graph_funcs import mark_pickup_relationship , set_last_calce
 
 # from matching_library
 from .vipps_payment import request_payment , pay_seller_and_driver
+from .changes import mark_changed
 
 # other stuff
 from fpdf import FPDF
@@ -38,6 +39,16 @@ VEDBJORN_COMPANY : dict = {
     "companyaddress" : "Adalsveien 1B , 3185 , SKOPPUM"
 }
 
+"""
+    county_of_route :
+
+    The county of the argument route (the county of the home of the driver), for mark_changed. None if it is not known
+"""
+def county_of_route(route : list) -> str :
+    if not route :
+        return None
+    return route[0].get('from' , {}).get('county')
+
 """
     Function : handle_routes
 
@@ -62,7 +73,7 @@ def handle_routes(routes: dict , is_fake : bool = False, calc_time : datetime.da
             another mission, which is currently being processed. The driver is not available for another mission yet
             """
             update_available_driveRequest(driveRequest_name , False)
-            set_graph_changed()
+            mark_changed('DriveRequest' , driveRequest_name , county_of_route(route))
             continue
 
         overwrite_planned_route(driveRequest_name, route, is_fake, calc_time)
@@ -369,6 +380,8 @@ def load_ongoing_route(driveRequest_name : str) -> dict :
 def decline_planned_route(planned_routes: dict):
     db = get_db()
     set_driver_available(planned_routes['driveRequestName'], False)
+    mark_changed('DriveRequest' , planned_routes['driveRequestName'] ,
+                 county_of_route(planned_routes.get('route' , [])))
     db.insist_on_delete_one('planned_routes', planned_routes['_id'])
 
 """
@@ -381,6 +394,8 @@ def decline_planned_route(planned_routes: dict):
 def claim_planned_route(planned_routes: dict, is_fake: bool = False, calc_time: datetime.datetime = datetime.datetime.utcnow()):
     db = get_db()
     set_driver_available(planned_routes['driveRequestName'], False)
+    mark_changed('DriveRequest' , planned_routes['driveRequestName'] ,
+                 county_of_route(planned_routes.get('route' , [])))
     db.insist_on_delete_one('planned_routes', planned_routes['_id'])
     del planned_routes['_id']
     if is_fake:
@@ -424,6 +439,7 @@ def claim_planned_route(planned_routes: dict, is_fake: bool = False, calc_time:
                 'ongoing_routes': inserted_id
             })
             set_claimed_by_driver_on_buyRequest(buyRequest_name, True)
+            mark_changed('BuyRequest' , buyRequest_name , trip.get('to', {}).get('county'))
 
     return planned_routes
 
@@ -918,6 +934,8 @@ def wrap_up_ongoing_route(ongoing_route_id : str, is_fake : bool = False,
             remove_travel_to_deliver(ongoing_route['driveRequestName'])
             remove_staged_driver(ongoing_route['driveRequestName'])
             set_driver_available(ongoing_route['driveRequestName'], True)
+            mark_changed('DriveRequest' , ongoing_route['driveRequestName'] ,
+                         county_of_route(ongoing_route.get('route' , [])))
 
             wrap_up_obj : dict = {
                 'total_income_from_sales_paid' : total_income_from_sales_paid ,
@@ -1299,6 +1317,7 @@ def close_planned_deals(planned_deals , completed_deals, ongoing_route, is_fake
     # Finally : Update the graph
     #
     sellRequest : dict = None
+    county : str = None
     updated_num_reserved : int = 0
     updated_amount_reserved : int = 0
     for completed in completed_sells :
@@ -1307,6 +1326,7 @@ def close_planned_deals(planned_deals , completed_deals, ongoing_route, is_fake
             sellRequest = visitObj.get('sellRequest' , None)
         buyRequest = visitObj['buyRequest']
         buyRequest_name = buyRequest['name']
+        county = visitObj.get('to' , {}).get('county' , county)
         set_last_calced_BuyRequest(buyRequest_name , calc_time.timestamp())
         set_claimed_by_driver_on_buyRequest(buyRequest_name, False)
         remove_reservation(buyRequest_name)
@@ -1319,6 +1339,7 @@ def close_planned_deals(planned_deals , completed_deals, ongoing_route, is_fake
                 updated_num_reserved = updated_num_reserved + 1
                 updated_amount_reserved = updated_amount_reserved + \
                         (updated_reserved_weeks * buyRequest.get('current_requirement'))
+        mark_changed('BuyRequest' , buyRequest_name , county)
 
     previous_capacity = sellRequest.get('current_capacity' , 0)
     capacity_reduction_due_to_reservations = sellRequest.get('amount_reserved' , 0) - updated_amount_reserved
@@ -1337,6 +1358,7 @@ def close_planned_deals(planned_deals , completed_deals, ongoing_route, is_fake
         new_amount_staged   = 0                       , # the staged-sells are zero (non-reserved staged sells) because they have been done
         new_num_reserved    = updated_num_reserved    , # amount of clients with one or more weeks of reservations has potentially been reduced
         new_num_staged      = 0                       ) # there are no more clients with staged sells for this seller now
+    mark_changed('SellRequest' , sellRequest['name'] , county)
 
     print('NEW completed deal for ' , seller_name)
 
@@ -0,0 +1,346 @@
+"""
+    File : assignment.py
+    Date : 18.10.2026
+    Description :
+
+Contains the min-cost-flow assignment of buyers to sellers, used as an alternative to the greedy buyer-by-buyer
+matching of the ordinary sales (see stage_sales_by_flow_in_county in "matching.py"). Nothing in here knows about the
+graph : buyers and sellers are given as coordinates (arrays from to_radians in "geo.py"), demands and capacities.
+
+Each buyer is connected to its K nearest sellers (which can take the whole demand of the buyer), with the distance as
+the cost. The flow starts out with every buyer sending its demand to its nearest seller, which is the cheapest flow
+there is, but which may put more on some sellers than they can take. The overloads are then moved, along the shortest
+paths of the residual graph (successive shortest paths, with Dijkstra and node-potentials), to sellers with capacity
+left, until there are no overloads left, or the time-budget has run out. Every buyer is also connected to an
+"unserved" seller, with unlimited capacity and a very high cost, so that what can not be served is taken from the
+buyers where it costs the least. The flow is a fractional one (a buyer may be split between sellers), so it is
+rounded to one seller per buyer afterwards. Buyers which can not be placed are left to the greedy matching.
+
+"""
+
+# from standard Python
+import heapq
+import time
+
+# other stuff
+import numpy as np
+
+# from matching_library
+from .geo import distance_matrix
+
+K_NEAREST : int = 8
+TIME_BUDGET_S : float = 10.0
+MAX_MATRIX_CELLS : int = 4000000
+COST_UNIT_M : int = 250
+UNSERVED_COST : int = 10 ** 9
+EPSILON : float = 1e-9
+
+"""
+    k_nearest_sellers :
+
+    For each buyer, the K nearest sellers and the distances (km) to them, nearest first, as two arrays of shape
+    (len(buyer_coordinates), min(K, len(seller_coordinates))). The distance-matrix is made in chunks of buyers, to keep
+    the memory bounded
+"""
+def k_nearest_sellers(buyer_coordinates : np.ndarray, seller_coordinates : np.ndarray, k : int = K_NEAREST) -> tuple :
+    num_buyers , num_sellers = len(buyer_coordinates) , len(seller_coordinates)
+    k = min(k, num_sellers)
+    nearest = np.zeros((num_buyers, k), dtype = np.int64)
+    distances = np.zeros((num_buyers, k))
+    if k <= 0 :
+        return nearest , distances
+    chunk = max(1, MAX_MATRIX_CELLS // num_sellers)
+    for begin in range(0, num_buyers, chunk) :
+        matrix = distance_matrix(buyer_coordinates[begin:begin + chunk], seller_coordinates)
+        if k < num_sellers :
+            candidates = np.argpartition(matrix, k - 1, axis = 1)[:, :k]
+        else :
+            candidates = np.tile(np.arange(num_sellers), (len(matrix), 1))
+        candidate_distances = np.take_along_axis(matrix, candidates, axis = 1)
+        by_distance = np.argsort(candidate_distances, axis = 1, kind = 'stable')
+        nearest[begin:begin + chunk] = np.take_along_axis(candidates, by_distance, axis = 1)
+        distances[begin:begin + chunk] = np.take_along_axis(candidate_distances, by_distance, axis = 1)
+    return nearest , distances
+
+"""
+    Class : MinCostFlowAssignment
+
+    Description :
+        The assignment of buyers (with a demand each) to sellers (with a capacity each), minimizing the total distance.
+        Create it, call solve(), and read "assigned" : the seller-index of each buyer, or -1 for the buyers which
+        could not be placed. "stats" tells how the solving went.
+
+        Costs are whole multiples of "cost_unit" meters, so that the potentials stay exact. The flow is the cheapest
+        there is for those costs, which is within half a cost-unit per buyer of the cheapest for the exact distances.
+        Coarser units make for more paths of the same cost, which are then moved in the same phase, and so a faster
+        solve.
+
+"""
+class MinCostFlowAssignment :
+
+    def __init__(self, buyer_coordinates : np.ndarray, demands : list, seller_coordinates : np.ndarray,
+                 capacities : list, k : int = K_NEAREST, cost_unit : int = COST_UNIT_M):
+        self.demands : list = [float(demand) for demand in demands]
+        self.num_buyers : int = len(self.demands)
+        # The last seller is the "unserved" one
+        self.unserved : int = len(capacities)
+        self.capacities : list = [float(capacity) for capacity in capacities] + [float('inf')]
+        self.num_sellers : int = len(self.capacities)
+        nearest , distances = k_nearest_sellers(buyer_coordinates, seller_coordinates, k)
+        self.cost_unit = cost_unit
+        units = np.rint(distances * 1000.0 / cost_unit).astype(np.int64)
+
+        # The candidates of each buyer, nearest first : the sellers which could take its whole demand on their own
+        self.candidates : list = []
+        self.cost : list = []
+        for buyer , demand in enumerate(self.demands) :
+            candidates : list = []
+            cost : dict = {}
+            for seller , unit in zip(nearest[buyer].tolist(), units[buyer].tolist()) :
+                if self.capacities[seller] + EPSILON >= demand :
+                    candidates.append((seller, unit))
+                    cost[seller] = unit
+            candidates.append((self.unserved, UNSERVED_COST))
+            cost[self.unserved] = UNSERVED_COST
+            self.candidates.append(candidates)
+            self.cost.append(cost)
+
+        self.flow : list = [{} for _ in range(self.num_buyers)]      # buyer  -> { seller : amount }
+        self.inflow : list = [{} for _ in range(self.num_sellers)]   # seller -> { buyer  : amount }
+        self.load : list = [0.0] * self.num_sellers
+        self.buyer_potential : list = [0] * self.num_buyers
+        self.seller_potential : list = [0] * self.num_sellers
+        self.sink_potential : int = 0
+        self.assigned : list = [-1] * self.num_buyers
+        self.stats : dict = {
+            'phases'        : 0 ,
+            'augmentations' : 0 ,
+            'optimal'       : False ,
+            'seconds'       : 0.0 ,
+            'unassigned'    : 0
+        }
+
+    def _move(self, buyer : int, seller : int, amount : float) :
+        now = self.flow[buyer].get(seller, 0.0) + amount
+        if now > EPSILON :
+            self.flow[buyer][seller] = now
+            self.inflow[seller][buyer] = now
+        else :
+            self.flow[buyer].pop(seller, None)
+            self.inflow[seller].pop(buyer, None)
+        self.load[seller] = self.load[seller] + amount
+
+    def _excess(self, seller : int) -> float :
+        return self.load[seller] - self.capacities[seller]
+
+    """
+        solve :
+
+        Find the flow, and round it to one seller per buyer. Returns "assigned"
+    """
+    def solve(self, time_budget : float = TIME_BUDGET_S) -> list :
+        started = time.monotonic()
+
+        # Everyone to their nearest candidate. With the potential of a buyer set to minus that distance, and 0 on
+        # every seller, all the edges of the residual graph has a reduced cost >= 0
+        for buyer , candidates in enumerate(self.candidates) :
+            seller , unit = candidates[0]
+            self._move(buyer, seller, self.demands[buyer])
+            self.buyer_potential[buyer] = -unit
+        overloaded : set = {seller for seller in range(self.num_sellers) if self._excess(seller) > EPSILON}
+
+        # Primal-dual : find the shortest distances once per phase, then move as much as possible along the paths
+        # which are shortest, before finding the distances again
+        deadline = started + time_budget
+        stuck : set = set()
+        while len(overloaded - stuck) > 0 and time.monotonic() <= deadline :
+            source = min(overloaded - stuck)
+            if not self._update_potentials({source}) :
+                stuck.add(source)
+                continue
+            self.stats['phases'] = self.stats['phases'] + 1
+            if self._augment_phase({source}, overloaded, deadline, True) <= 0 and \
+               self._augment_phase({source}, overloaded, deadline, False) <= 0 :
+                stuck.add(source)
+        self.stats['optimal'] = len(overloaded) <= 0
+
+        self._round()
+        self.stats['seconds'] = time.monotonic() - started
+        self.stats['unassigned'] = self.assigned.count(-1)
+        return self.assigned
+
+    """
+        _update_potentials :
+
+        Dijkstra from the argument overloaded sellers, over the residual graph (seller -> buyer where the buyer
+        sends flow to the seller, buyer -> seller for its other candidates, and seller -> sink for the sellers with
+        capacity left), until the sink is reached. The potentials are then moved by the distances, so that the
+        shortest paths to the sink get a reduced cost of 0 (and no edge gets a reduced cost below 0). Returns False
+        if the sink was not reached. Seller-nodes are their index, buyer-nodes are their index + the number of
+        sellers, and the sink is -1
+    """
+    def _update_potentials(self, sources : set) -> bool :
+        offset = self.num_sellers
+        distance : dict = {}
+        done : dict = {}
+        queue : list = []
+        for seller in sources :
+            distance[seller] = 0
+            heapq.heappush(queue, (0, seller))
+        reached = -1
+        while queue :
+            dist , node = heapq.heappop(queue)
+            if node in done :
+                continue
+            if node < 0 :
+                reached = dist
+                break
+            done[node] = dist
+            if node < offset :
+                seller = node
+                if self._excess(seller) < -EPSILON :
+                    next_dist = dist + self.seller_potential[seller] - self.sink_potential
+                    if next_dist < distance.get(-1, next_dist + 1) :
+                        distance[-1] = next_dist
+                        heapq.heappush(queue, (next_dist, -1))
+                for buyer in self.inflow[seller].keys() :
+                    next_dist = dist - self.cost[buyer][seller] + self.seller_potential[seller] - self.buyer_potential[buyer]
+                    if next_dist < distance.get(buyer + offset, next_dist + 1) :
+                        distance[buyer + offset] = next_dist
+                        heapq.heappush(queue, (next_dist, buyer + offset))
+            else :
+                buyer = node - offset
+                for seller , unit in self.candidates[buyer] :
+                    if self.flow[buyer].get(seller, 0.0) >= self.demands[buyer] - EPSILON :
+                        continue
+                    next_dist = dist + unit + self.buyer_potential[buyer] - self.seller_potential[seller]
+                    if next_dist < distance.get(seller, next_dist + 1) :
+                        distance[seller] = next_dist
+                        heapq.heappush(queue, (next_dist, seller))
+        if reached < 0 :
+            return False
+        for node , dist in done.items() :
+            if dist < reached :
+                if node < offset :
+                    self.seller_potential[node] = self.seller_potential[node] + dist - reached
+                else :
+                    self.buyer_potential[node - offset] = self.buyer_potential[node - offset] + dist - reached
+        return True
+
+    """
+        _admissible_path :
+
+        A path of residual edges with a reduced cost of 0, from the argument overloaded seller to the sink (through a
+        seller with capacity left), by depth-first search. Moving flow along such a path keeps the flow the cheapest
+        there is for what it serves. Returns the list of nodes, without the sink, or None.
+
+        The nodes which turn out to have no such path are added to "dead", and are not searched again in the same
+        phase : moving flow only adds edges from nodes which did have a path
+    """
+    def _admissible_path(self, source : int, overloaded : set, dead : dict) :
+        offset = self.num_sellers
+        if source in dead :
+            return None
+        visited : dict = {source : True}
+        path : list = [source]
+        branches : list = [self._admissible_edges(source)]
+        while branches :
+            node = next(branches[-1], None)
+            if node is None :
+                branches.pop()
+                dead[path.pop()] = True
+                continue
+            if node in visited or node in dead :
+                continue
+            visited[node] = True
+            path.append(node)
+            if node < offset and not node in overloaded and self._excess(node) < -EPSILON and \
+               self.seller_potential[node] == self.sink_potential :
+                return path
+            branches.append(self._admissible_edges(node))
+        return None
+
+    def _admissible_edges(self, node : int) :
+        offset = self.num_sellers
+        if node < offset :
+            seller = node
+            for buyer in list(self.inflow[seller].keys()) :
+                if self.seller_potential[seller] - self.buyer_potential[buyer] == self.cost[buyer][seller] :
+                    yield buyer + offset
+        else :
+            buyer = node - offset
+            for seller , unit in self.candidates[buyer] :
+                if self.flow[buyer].get(seller, 0.0) < self.demands[buyer] - EPSILON and \
+                   unit + self.buyer_potential[buyer] == self.seller_potential[seller] :
+                    yield seller
+
+    """
+        _augment_phase :
+
+        Move flow along admissible paths, from each overloaded seller, for as long as there are such paths. With
+        "share_dead", nodes found to have no path are skipped for the rest of the phase. That is exact as long as
+        the admissible edges has no cycles, so if it finds nothing, the phase is tried again without it. Returns the
+        number of paths moved along
+    """
+    def _augment_phase(self, sources : set, overloaded : set, deadline : float, share_dead : bool) -> int :
+        augmentations = 0
+        dead : dict = {}
+        for source in sorted(sources) :
+            if not share_dead :
+                dead = {}
+            while source in overloaded and time.monotonic() <= deadline :
+                path = self._admissible_path(source, overloaded, dead)
+                if not path :
+                    break
+                self._augment(path, overloaded)
+                augmentations = augmentations + 1
+        self.stats['augmentations'] = self.stats['augmentations'] + augmentations
+        return augmentations
+
+    def _augment(self, path : list, overloaded : set) :
+        offset = self.num_sellers
+        amount = min(self._excess(path[0]), -self._excess(path[-1]))
+        for at in range(1, len(path) - 1, 2) :
+            buyer = path[at] - offset
+            amount = min(amount, self.flow[buyer].get(path[at - 1], 0.0),
+                         self.demands[buyer] - self.flow[buyer].get(path[at + 1], 0.0))
+        for at in range(1, len(path) - 1, 2) :
+            buyer = path[at] - offset
+            self._move(buyer, path[at - 1], -amount)
+            self._move(buyer, path[at + 1], amount)
+        for seller in (path[0], path[-1]) :
+            if self._excess(seller) > EPSILON :
+                overloaded.add(seller)
+            else :
+                overloaded.discard(seller)
+
+    """
+        _round :
+
+        Give each buyer one seller. Buyers which are not split, and sends their flow to a seller which is not
+        overloaded, keep that seller. The rest are placed after those, nearest first, at the seller with the most of
+        their flow, or at their nearest candidate with enough capacity left. The ones whose flow is mostly unserved
+        come last
+    """
+    def _round(self) :
+        left : list = list(self.capacities)
+        order : list = []
+        for buyer , flow in enumerate(self.flow) :
+            if not flow :
+                continue
+            main_seller = max(flow.keys(), key = lambda seller : (flow[seller], -self.cost[buyer][seller]))
+            settled = len(flow) == 1 and self._excess(main_seller) <= EPSILON
+            order.append((0 if settled else 1, self.cost[buyer][main_seller], buyer))
+        order.sort()
+        for _ , _ , buyer in order :
+            demand = self.demands[buyer]
+            flow = self.flow[buyer]
+            preferred = sorted(flow.keys(), key = lambda seller : (-flow[seller], self.cost[buyer][seller]))
+            for seller in preferred + [seller for seller , _ in self.candidates[buyer]] :
+                if seller == self.unserved :
+                    continue
+                if left[seller] + EPSILON >= demand :
+                    left[seller] = left[seller] - demand
+                    self.assigned[buyer] = seller
+                    break
+
@@ -0,0 +1,146 @@
+"""
+    File : benchmark_assignment.py
+    Date : 18.10.2026
+    Description :
+
+Compares the two engines for the ordinary sales, the greedy one (stage_sales_in_county) and the min-cost-flow one
+(stage_sales_by_flow_in_county), on synthetic counties, by runtime and by the total distance (km) between the buyers
+and the sellers they were matched with. Nothing is read from, or written to, the graph.
+
+Run it like this, from the root of the service :
+
+    python -m libs.matchlib.benchmark_assignment 1000 10000 100000
+
+"""
+
+# from standard Python
+import contextlib
+import datetime
+import io
+import random
+import sys
+import time
+
+# from common_library
+from libs.commonlib.location_funcs import distance_between_coordinates
+
+# from matching_library
+from .snapshot import CountySnapshot
+from .graph_writes import StagedSellWriteBuffer
+from .matching import stage_sales_in_county , stage_sales_by_flow_in_county
+
+BUYERS_PER_SELLER : int = 20
+BUYERS_PER_POSTCODE : int = 200
+CAPACITY_SLACK : float = 1.1
+
+"""
+    make_synthetic_county :
+
+    A county of "num_buyers" ordinary buyers and their sellers, in postcodes spread over a 1 x 2 degree area. The
+    buyers and sellers cluster around the centres of the postcodes, and the total capacity of the sellers is
+    CAPACITY_SLACK times the total requirement of the buyers. Returns the SellRequest- and BuyRequest-lists, in the
+    layout of get_sell_requests_in_county and get_buyrequests_without_reservations_in_county
+"""
+def make_synthetic_county(num_buyers : int, seed : int = 1) -> tuple :
+    rnd = random.Random(seed)
+    num_postcodes = max(1, num_buyers // BUYERS_PER_POSTCODE)
+    centres : list = [(59.0 + rnd.uniform(0.0, 1.0), 10.0 + rnd.uniform(0.0, 2.0)) for _ in range(num_postcodes)]
+
+    def location(name : str) -> dict :
+        postcode = rnd.randrange(num_postcodes)
+        lat , lon = centres[postcode]
+        return {
+            'name' : name ,
+            'lat' : lat + rnd.gauss(0.0, 0.03) ,
+            'lon' : lon + rnd.gauss(0.0, 0.06) ,
+            'postcode' : postcode
+        }
+
+    buy_requests : list = []
+    for index in range(num_buyers) :
+        name = 'BuyRequest-' + str(index)
+        buy_requests.append([
+            {'name' : name , 'current_requirement' : rnd.randint(1, 8)} ,
+            {'name' : 'buyer-' + str(index)} ,
+            location('buy-location-' + str(index))
+        ])
+    total_requirement = sum(buy_request[0]['current_requirement'] for buy_request in buy_requests)
+
+    num_sellers = max(1, num_buyers // BUYERS_PER_SELLER)
+    weights : list = [rnd.uniform(0.2, 1.8) for _ in range(num_sellers)]
+    sell_requests : list = []
+    for index in range(num_sellers) :
+        name = 'SellRequest-' + str(index)
+        sell_requests.append([
+            {
+                'name' : name ,
+                'current_capacity' : round(CAPACITY_SLACK * total_requirement * weights[index] / sum(weights)) ,
+                'amount_reserved' : 0 ,
+                'amount_staged' : 0 ,
+                'num_staged' : 0
+            } ,
+            {'name' : 'seller-' + str(index)} ,
+            location('sell-location-' + str(index))
+        ])
+    return sell_requests , buy_requests
+
+"""
+    check_staged_sales :
+
+    Raise an Exception if a buyer was staged more than once, or a seller was given more than its current_capacity
+    (the synthetic sellers start out with nothing reserved or staged)
+"""
+def check_staged_sales(staged_sells : list, sell_requests : list, buy_requests : list) :
+    requirement_of : dict = {buy_request[0]['name'] : buy_request[0]['current_requirement']
+                             for buy_request in buy_requests}
+    capacity_of : dict = {sell_request[0]['name'] : sell_request[0]['current_capacity']
+                          for sell_request in sell_requests}
+    staged_buyers : set = set()
+    sold : dict = {}
+    for buyRequest_name , sellRequest_name , _ in staged_sells :
+        if buyRequest_name in staged_buyers :
+            raise Exception('check_staged_sales : ' + buyRequest_name + ' was staged more than once')
+        staged_buyers.add(buyRequest_name)
+        sold[sellRequest_name] = sold.get(sellRequest_name, 0) + requirement_of[buyRequest_name]
+    for sellRequest_name , amount in sold.items() :
+        if amount > capacity_of[sellRequest_name] :
+            raise Exception('check_staged_sales : ' + sellRequest_name + ' was given ' + str(amount) +
+                            ' , but has a capacity of ' + str(capacity_of[sellRequest_name]))
+
+"""
+    run_engine :
+
+    Match one synthetic county with the argument county-function, on a snapshot filled with the synthetic data, and
+    check the staged sales (see check_staged_sales). Returns the runtime (seconds), the total distance (km), and the
+    number of staged and failed sales
+"""
+def run_engine(county_function, sell_requests : list, buy_requests : list) -> tuple :
+    calc_time = datetime.datetime.utcnow()
+    snapshot = CountySnapshot.from_rows('synthetic', calc_time, sell_requests = sell_requests,
+                                        ordinary_requests = buy_requests, staged_sells = [])
+    writes = StagedSellWriteBuffer()
+
+    started = time.monotonic()
+    with contextlib.redirect_stdout(io.StringIO()) :
+        ok_sales , failed_sales = county_function(snapshot, calc_time, writes)
+    seconds = time.monotonic() - started
+    check_staged_sales(writes.staged_sells, sell_requests, buy_requests)
+
+    buy_location_of : dict = {buy_request[0]['name'] : buy_request[2] for buy_request in buy_requests}
+    sell_location_of : dict = {sell_request[0]['name'] : sell_request[2] for sell_request in sell_requests}
+    total_km : float = 0.0
+    for buyRequest_name , sellRequest_name , _ in writes.staged_sells :
+        total_km = total_km + distance_between_coordinates(sell_location_of[sellRequest_name], buy_location_of[buyRequest_name])
+    return seconds , total_km , len(writes.staged_sells) , len(failed_sales)
+
+def main(sizes : list) :
+    print('buyers     engine    seconds     total km     staged    failed')
+    for num_buyers in sizes :
+        for engine , county_function in (('greedy', stage_sales_in_county), ('flow', stage_sales_by_flow_in_county)) :
+            # The engines change the SellRequests, so each gets its own copy of the county
+            sell_requests , buy_requests = make_synthetic_county(num_buyers)
+            seconds , total_km , num_staged , num_failed = run_engine(county_function, sell_requests, buy_requests)
+            print('%-10d %-9s %8.2f %12.1f %10d %9d' % (num_buyers, engine, seconds, total_km, num_staged, num_failed))
+
+if __name__ == '__main__' :
+    main([int(size) for size in sys.argv[1:]] or [1000, 10000, 100000])
@@ -0,0 +1,137 @@
+"""
+    File : changes.py
+    Date : 18.10.2026
+    Description :
+
+Contains the record of which BuyRequests, SellRequests and DriveRequests has changed since the last planning
+iteration. Whoever changes a request (like "actions.py") calls mark_changed, and the planner loads the changes with
+load_changes, to re-match only what was changed, and what it affects (see "incremental" in "prepare.py")
+
+Every writer of BuyRequests, SellRequests and DriveRequests must call mark_changed, with the county when it is known :
+that goes for the services outside this library too (like the web service, when it creates or edits a request). A
+request which is changed without it is not seen by the incremental iterations, until the next full one (see
+FULL_ITERATION_EVERY in "prepare.py")
+
+A full iteration matches everything again, so the changes recorded before it are pruned (see prune_changes), and the
+collection only holds the changes since the last full iteration.
+
+"""
+
+# from standard Python
+import datetime
+
+# from common_library
+from libs.commonlib.db_insist import get_db , set_graph_changed
+from libs.commonlib.pymongo_paginated_cursor import PaginatedCursor as mpcur
+
+GRAPH_CHANGES : str = 'graph_changes'
+REQUEST_KINDS : tuple = ('BuyRequest' , 'SellRequest' , 'DriveRequest')
+
+"""
+    Function : mark_changed
+
+    Description :
+        Record that a request has changed, and tell the planner that the graph has changed. The county should be given
+        when it is known : a change without a county makes the next incremental iteration visit every county
+
+"""
+def mark_changed(kind : str , name : str , county : str = None ,
+                 calc_time : datetime.datetime = None) :
+    if not kind in REQUEST_KINDS :
+        raise Exception('mark_changed : unknown kind of request : ' + str(kind))
+    if not calc_time :
+        calc_time = datetime.datetime.utcnow()
+    get_db().insist_on_insert_one(GRAPH_CHANGES , {
+        'kind' : kind ,
+        'name' : name ,
+        'county' : county ,
+        'timestamp' : calc_time.timestamp()
+    })
+    set_graph_changed()
+
+"""
+    Class : ChangeSet
+
+    Description :
+        The requests which has changed since some point in time, by kind. "until" is the timestamp of the newest
+        change, which is what the next iteration should load changes since.
+
+"""
+class ChangeSet :
+
+    def __init__(self, changes : list = None, since : float = 0):
+        if changes is None :
+            changes = []
+        self.names : dict = {kind : set() for kind in REQUEST_KINDS}
+        self.counties : dict = {kind : set() for kind in REQUEST_KINDS}
+        self.county_unknown : dict = {kind : False for kind in REQUEST_KINDS}
+        self.until : float = since
+        for change in changes :
+            self.add(change.get('kind' , '') , change.get('name' , '') , change.get('county') , change.get('timestamp' , since))
+
+    def add(self, kind : str , name : str , county : str = None , timestamp : float = 0) :
+        if not kind in self.names :
+            return
+        self.names[kind].add(name)
+        if county :
+            self.counties[kind].add(county)
+        else :
+            self.county_unknown[kind] = True
+        self.until = max(self.until , timestamp)
+
+    def __len__(self) :
+        return sum(len(names) for names in self.names.values())
+
+    def has_changed(self, kind : str , name : str) -> bool :
+        return name in self.names.get(kind , ())
+
+    """
+        dirty_counties :
+
+        The counties which has a change of one of the argument kinds, or None if that is not known (then all counties
+        must be visited). "county_of" maps request-names to counties, for the changes recorded without one
+    """
+    def dirty_counties(self, kinds : tuple , county_of : dict = None) :
+        if county_of is None :
+            county_of = {}
+        dirty : set = set()
+        for kind in kinds :
+            dirty.update(self.counties[kind])
+            if not self.county_unknown[kind] :
+                continue
+            for name in self.names[kind] :
+                if not name in county_of :
+                    return None
+                dirty.add(county_of[name])
+        return dirty
+
+"""
+    Function : load_changes
+
+    Description :
+        Load every change recorded after the argument timestamp
+
+"""
+def load_changes(since : float = 0) -> ChangeSet :
+    changes_it = get_db().insist_on_find(GRAPH_CHANGES , {
+        'timestamp' : { '$gt' : since }
+    })
+    return ChangeSet(list(mpcur(changes_it)) , since)
+
+"""
+    Function : prune_changes
+
+    Description :
+        Delete the changes recorded up to (and including) the argument timestamp, when a full iteration from that
+        time has made them useless. Returns the number of deleted changes
+
+"""
+def prune_changes(until : float) -> int :
+    db = get_db()
+    changes_it = db.insist_on_find(GRAPH_CHANGES , {
+        'timestamp' : { '$lte' : until }
+    })
+    old_changes : list = list(mpcur(changes_it))
+    for change in old_changes :
+        db.insist_on_delete_one(GRAPH_CHANGES , change['_id'])
+    return len(old_changes)
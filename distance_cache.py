@@ -0,0 +1,149 @@
+"""
+    File : distance_cache.py
+    Date : 18.10.2026
+    Description :
+
+Contains the cache of distances between Locations. Sellers, drivers and buyers rarely move between the planning
+iterations, so the same pairs of Locations are measured again and again : buyer-seller in the sales passes,
+driver-seller in organize_drivers, and seller-buyer and buyer-buyer in organize_routes. The distances are kept by
+(Location name , Location name) in an in-process LRU, which can be stored to disk (as JSON) between restarts. The
+distance between two Locations is the same both ways, so each pair is kept once, with the names in sorted order.
+
+Each entry takes about 250 bytes, and every worker-process has its own cache, so DISTANCE_CACHE_SIZE is kept well
+below the number of pairs in a large county. DISTANCE_CACHE_SIZE and DISTANCE_CACHE_PATH are read when they are used,
+so they can be set after this module is imported.
+
+Each cached distance remembers the coordinates it was measured between, so a Location which has moved is measured
+again (and counted as "invalidated").
+
+"""
+
+# from standard Python
+import json
+import os
+from collections import OrderedDict
+
+# from common_library
+from libs.commonlib.location_funcs import distance_between_coordinates
+
+DISTANCE_CACHE_SIZE : int = 50000
+DISTANCE_CACHE_PATH : str = ''
+
+"""
+    Class : DistanceCache
+
+    Description :
+        The distances (km, from distance_between_coordinates) between pairs of Locations, by their names. When there
+        are more than max_size pairs, the least recently used are forgotten. If a path is given, the cache is read from
+        that file on first use, and written to it by save(). Locations without a name are measured, but not cached.
+
+        Without a max_size or path, DISTANCE_CACHE_SIZE and DISTANCE_CACHE_PATH are used, as they are at the time.
+
+"""
+class DistanceCache :
+
+    def __init__(self, max_size : int = None, path : str = None):
+        self.max_size : int = max_size
+        self.path : str = path
+        self.distances : OrderedDict = OrderedDict()
+        self.loaded : bool = False
+        self.hits : int = 0
+        self.misses : int = 0
+        self.invalidated : int = 0
+
+    def _max_size(self) -> int :
+        return DISTANCE_CACHE_SIZE if self.max_size is None else self.max_size
+
+    def _path(self) -> str :
+        return DISTANCE_CACHE_PATH if self.path is None else self.path
+
+    """
+        _load :
+
+        Read the cache from its path, which holds one [name_a, name_b, lat_a, lon_a, lat_b, lon_b, distance] list
+        for each pair, from the least to the most recently used
+    """
+    def _load(self) :
+        self.loaded = True
+        path = self._path()
+        if not path or not os.path.isfile(path) :
+            return
+        try :
+            with open(path, 'r') as cache_file :
+                stored = json.load(cache_file)
+            for name_a , name_b , lat_a , lon_a , lat_b , lon_b , measured in stored :
+                self.distances[(name_a, name_b)] = (lat_a, lon_a, lat_b, lon_b, measured)
+        except Exception as e :
+            print('DistanceCache : could not read ', path, ' : ', e)
+            return
+        self._trim()
+
+    def _trim(self) :
+        max_size = self._max_size()
+        while len(self.distances) > max_size :
+            self.distances.popitem(last = False)
+
+    def __len__(self) :
+        return len(self.distances)
+
+    """
+        distance :
+
+        The distance from location_a to location_b. The pair is measured (and kept) with the names in sorted order,
+        so the same distance is returned both ways
+    """
+    def distance(self, location_a : dict, location_b : dict) -> float :
+        if not self.loaded :
+            self._load()
+        name_a = location_a.get('name')
+        name_b = location_b.get('name')
+        if not name_a or not name_b :
+            self.misses = self.misses + 1
+            return distance_between_coordinates(location_a, location_b)
+        if name_b < name_a :
+            name_a , name_b = name_b , name_a
+            location_a , location_b = location_b , location_a
+        key = (name_a, name_b)
+        cached = self.distances.get(key)
+        if cached is not None :
+            if cached[0] == location_a['lat'] and cached[1] == location_a['lon'] and \
+                    cached[2] == location_b['lat'] and cached[3] == location_b['lon'] :
+                self.hits = self.hits + 1
+                self.distances.move_to_end(key)
+                return cached[4]
+            self.invalidated = self.invalidated + 1
+        self.misses = self.misses + 1
+        measured = distance_between_coordinates(location_a, location_b)
+        self.distances[key] = (location_a['lat'], location_a['lon'], location_b['lat'], location_b['lon'], measured)
+        self.distances.move_to_end(key)
+        self._trim()
+        return measured
+
+    def stats(self) -> dict :
+        return {
+            'size' : len(self.distances) ,
+            'hits' : self.hits ,
+            'misses' : self.misses ,
+            'invalidated' : self.invalidated
+        }
+
+    """
+        save :
+
+        Write the cache to its path (if it has one). The file is replaced in one step, so that a crash while writing
+        leaves the previous one
+    """
+    def save(self) :
+        path = self._path()
+        if not path :
+            return
+        temporary_path = path + '.tmp'
+        with open(temporary_path, 'w') as cache_file :
+            json.dump([[name_a, name_b] + list(cached) for (name_a , name_b) , cached in self.distances.items()],
+                      cache_file)
+        os.replace(temporary_path, path)
+
+"""
+    The cache shared by the matching passes and the routes, in this process
+"""
+distance_cache = DistanceCache()
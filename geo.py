@@ -0,0 +1,557 @@
+"""
+    File : geo.py
+    Date : 18.10.2026
+    Description :
+
+Contains the geographic index used by the matching passes in "prepare.py" to find the nearest seller or driver,
+without measuring the distance to every single candidate in the county, and the batched (NumPy) distance functions
+used when many distances are needed at once (ordering deliveries, improving routes and the flow assignment)
+
+"""
+
+# from standard Python
+import heapq
+import math
+
+# other stuff
+import numpy as np
+
+LEAF_SIZE : int = 8
+RING_SLACK : float = 1e-9
+TIE_SLACK : float = 1e-9
+# The radius of distance_between_coordinates in commonlib. The batched functions must measure like it (great-circle,
+# haversine), or they would put Locations in another order than the distances written to the graph
+EARTH_RADIUS_KM : float = 6371.0
+
+"""
+    to_radians :
+
+    Convert a list of Locations (dicts with 'lat' and 'lon' in degrees) into a NumPy array of shape (n, 2), holding
+    latitude and longitude in radians. This is the coordinate-format of the batched distance functions below
+"""
+def to_radians(locations : list) -> np.ndarray :
+    if len(locations) <= 0 :
+        return np.empty((0, 2))
+    return np.radians(np.array([[float(location['lat']), float(location['lon'])] for location in locations]))
+
+"""
+    distances_from :
+
+    The haversine distance (km) from one origin, either a Location or a row from to_radians, to all the coordinates
+    in an array from to_radians
+"""
+def distances_from(origin, coordinates : np.ndarray) -> np.ndarray :
+    if isinstance(origin, dict) :
+        origin = to_radians([origin])[0]
+    lat , lon = origin[0] , origin[1]
+    half_dlat = (coordinates[:, 0] - lat) * 0.5
+    half_dlon = (coordinates[:, 1] - lon) * 0.5
+    h = np.sin(half_dlat) ** 2 + np.cos(lat) * np.cos(coordinates[:, 0]) * np.sin(half_dlon) ** 2
+    return 2.0 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(h, 0.0, 1.0)))
+
+"""
+    distance_matrix :
+
+    The haversine distance (km) between every pair of coordinates (arrays from to_radians), with shape
+    (len(coordinates), len(other)). Without "other", the coordinates are paired with themselves
+"""
+def distance_matrix(coordinates : np.ndarray, other : np.ndarray = None) -> np.ndarray :
+    if other is None :
+        other = coordinates
+    lat_a = coordinates[:, 0][:, np.newaxis]
+    lat_b = other[:, 0][np.newaxis, :]
+    half_dlat = (lat_b - lat_a) * 0.5
+    half_dlon = (other[:, 1][np.newaxis, :] - coordinates[:, 1][:, np.newaxis]) * 0.5
+    h = np.sin(half_dlat) ** 2 + np.cos(lat_a) * np.cos(lat_b) * np.sin(half_dlon) ** 2
+    return 2.0 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(h, 0.0, 1.0)))
+
+"""
+    to_unit_vector :
+
+    Convert a Location (with 'lat' and 'lon' in degrees) into a point on the unit sphere. The straight-line (chord)
+    distance between two such points grows with the great-circle (haversine) distance between the Locations, so the
+    nearest point in 3D is also the nearest Location on the ground
+"""
+def to_unit_vector(location : dict) -> tuple :
+    lat = math.radians(float(location['lat']))
+    lon = math.radians(float(location['lon']))
+    cos_lat = math.cos(lat)
+    return cos_lat * math.cos(lon) , cos_lat * math.sin(lon) , math.sin(lat)
+
+def to_unit_vectors(coordinates : np.ndarray) -> list :
+    cos_lat = np.cos(coordinates[:, 0])
+    vectors = np.stack((cos_lat * np.cos(coordinates[:, 1]), cos_lat * np.sin(coordinates[:, 1]), np.sin(coordinates[:, 0])), axis = 1)
+    return [tuple(vector) for vector in vectors.tolist()]
+
+def _squared_chord(point : tuple, other : tuple) -> float :
+    return (other[0] - point[0]) ** 2 + (other[1] - point[1]) ** 2 + (other[2] - point[2]) ** 2
+
+"""
+    tie_radius :
+
+    The squared unit-sphere distance within which an entry counts as being as near as one at the argument squared
+    distance. The unit-sphere distance and the distance measured on the ground (like distance_between_coordinates in
+    commonlib) put the entries in the same order, except for rounding errors, so entries within this radius are
+    measured on the ground before one of them is chosen
+"""
+def tie_radius(squared : float) -> float :
+    return squared * (1.0 + TIE_SLACK) + TIE_SLACK
+
+def _squared_distance_to_box(point : tuple, lower : list, upper : list) -> float :
+    squared : float = 0.0
+    for axis in range(3):
+        if point[axis] < lower[axis]:
+            squared += (lower[axis] - point[axis]) ** 2
+        elif point[axis] > upper[axis]:
+            squared += (point[axis] - upper[axis]) ** 2
+    return squared
+
+"""
+    Class : LoadLevels
+
+    Description :
+        The loads of a set of entries (like the 'num_staged_pickups' of the drivers), counted by value, with the lowest
+        load kept at the top of a heap. Adding and removing a load costs O(log n), and the lowest load is found
+        without going through the others. A load which is no longer counted is left in the heap until it reaches the
+        top
+
+"""
+class LoadLevels :
+
+    def __init__(self, loads = ()):
+        self.counts : dict = {}
+        self.heap : list = []
+        for load in loads :
+            self.add(load)
+
+    def __len__(self) :
+        return len(self.counts)
+
+    def add(self, load) :
+        count = self.counts.get(load, 0)
+        if count <= 0 :
+            heapq.heappush(self.heap, load)
+        self.counts[load] = count + 1
+
+    def remove(self, load) :
+        count = self.counts[load] - 1
+        if count <= 0 :
+            del self.counts[load]
+        else :
+            self.counts[load] = count
+
+    def lowest(self) :
+        while self.heap and not self.heap[0] in self.counts :
+            heapq.heappop(self.heap)
+        return self.heap[0] if self.heap else None
+
+    """
+        __iter__ :
+
+        The loads, from the lowest to the highest. Only the lowest is taken from the heap, the others are sorted if
+        (and when) they are asked for
+    """
+    def __iter__(self) :
+        lowest = self.lowest()
+        if lowest is None :
+            return
+        yield lowest
+        for load in sorted(self.counts.keys()) :
+            if load > lowest :
+                yield load
+
+"""
+    Class : GeoIndex
+
+    Description :
+        A KD-tree over the unit-sphere points of a list of entries (like the [SellRequest, user, Location] lists from
+        the graph). It is built once, and answers "which entry is nearest to this Location, that has at least this much
+        capacity and at most this load". The capacity- and load-filters are applied during the search : every node in
+        the tree knows the largest capacity and the smallest load below it, so whole branches which cannot satisfy
+        the filters are never visited.
+
+        When the capacity or load of an entry changes, call refresh() with its position, to update the tree.
+
+        Ties in distance are resolved by the original order of the entries, just like a stable sort would do. With a
+        "distance" function (of two Locations : the one of the entry, and the one searched from), the entries which
+        are (about) as near as the nearest one are measured with it, and the nearest of those is chosen (see
+        nearest_least_loaded), so that ties come out as they would by measuring every entry with that function.
+
+"""
+class GeoIndex :
+
+    def __init__(self, entries : list, location_of, capacity_of = None, load_of = None):
+        self.entries = entries
+        self.location_of = location_of
+        self.capacity_of = capacity_of if capacity_of else lambda entry : math.inf
+        self.load_of = load_of if load_of else lambda entry : 0
+        self.points : list = to_unit_vectors(to_radians([location_of(entry) for entry in entries]))
+        self.capacity : list = [self.capacity_of(entry) for entry in entries]
+        self.load : list = [self.load_of(entry) for entry in entries]
+        self.load_levels : LoadLevels = LoadLevels(self.load)
+
+        # The tree is stored as flat lists, indexed by node number. Leaves have no children, and own the
+        # positions order[begin:end]
+        self.order : list = list(range(len(entries)))
+        self.begin : list = []
+        self.end : list = []
+        self.children : list = []
+        self.parent : list = []
+        self.lower : list = []
+        self.upper : list = []
+        self.max_capacity : list = []
+        self.min_load : list = []
+        self.leaf_of : list = [0] * len(entries)
+        if len(entries) > 0 :
+            self._build(0, len(entries), -1)
+
+    def __len__(self) :
+        return len(self.entries)
+
+    def _build(self, begin : int, end : int, parent : int) -> int :
+        node = len(self.begin)
+        positions = self.order[begin:end]
+        lower = [min(self.points[position][axis] for position in positions) for axis in range(3)]
+        upper = [max(self.points[position][axis] for position in positions) for axis in range(3)]
+        self.begin.append(begin)
+        self.end.append(end)
+        self.children.append(())
+        self.parent.append(parent)
+        self.lower.append(lower)
+        self.upper.append(upper)
+        self.max_capacity.append(-math.inf)
+        self.min_load.append(math.inf)
+        if end - begin <= LEAF_SIZE :
+            for position in positions :
+                self.leaf_of[position] = node
+        else :
+            axis = max(range(3), key = lambda a : upper[a] - lower[a])
+            positions.sort(key = lambda position : self.points[position][axis])
+            self.order[begin:end] = positions
+            middle = (begin + end) // 2
+            left = self._build(begin, middle, node)
+            right = self._build(middle, end, node)
+            self.children[node] = (left, right)
+        self._aggregate(node)
+        return node
+
+    def _aggregate(self, node : int) :
+        if self.children[node] :
+            left , right = self.children[node]
+            self.max_capacity[node] = max(self.max_capacity[left], self.max_capacity[right])
+            self.min_load[node] = min(self.min_load[left], self.min_load[right])
+        else :
+            positions = self.order[self.begin[node]:self.end[node]]
+            self.max_capacity[node] = max(self.capacity[position] for position in positions)
+            self.min_load[node] = min(self.load[position] for position in positions)
+
+    """
+        refresh :
+
+        Re-read the capacity and load of the entry at the argument position, after it has been changed
+    """
+    def refresh(self, position : int) :
+        self.load_levels.remove(self.load[position])
+        self.capacity[position] = self.capacity_of(self.entries[position])
+        self.load[position] = self.load_of(self.entries[position])
+        self.load_levels.add(self.load[position])
+        node = self.leaf_of[position]
+        while node >= 0 :
+            self._aggregate(node)
+            node = self.parent[node]
+
+    """
+        nearest :
+
+        Return the position of the nearest entry with capacity >= min_capacity and load <= max_load, or None. "point"
+        is the unit-sphere point of the Location, if the caller has it already
+    """
+    def nearest(self, location : dict, min_capacity : float = -math.inf, max_load : float = math.inf,
+                point : tuple = None) :
+        if len(self.entries) <= 0 :
+            return None
+        if self.min_load[0] > max_load :
+            return None
+        if point is None :
+            point = to_unit_vector(location)
+        # (squared distance , 0 for nodes / 1 for entries , tie-breaker , node or position)
+        # Nodes come before entries at the same distance, so that an entry is only returned when no unvisited branch
+        # can hold a nearer (or equally near, but earlier) entry
+        queue : list = [(0.0, 0, 0, 0)]
+        while queue :
+            squared , is_entry , _ , at = heapq.heappop(queue)
+            if is_entry :
+                return at
+            if self.max_capacity[at] < min_capacity or self.min_load[at] > max_load :
+                continue
+            if self.children[at] :
+                for child in self.children[at] :
+                    heapq.heappush(queue, (_squared_distance_to_box(point, self.lower[child], self.upper[child]), 0, child, child))
+            else :
+                for position in self.order[self.begin[at]:self.end[at]] :
+                    if self.capacity[position] < min_capacity or self.load[position] > max_load :
+                        continue
+                    entry_point = self.points[position]
+                    squared_distance = (entry_point[0] - point[0]) ** 2 + (entry_point[1] - point[1]) ** 2 + \
+                                       (entry_point[2] - point[2]) ** 2
+                    heapq.heappush(queue, (squared_distance, 1, position, position))
+        return None
+
+    """
+        within :
+
+        The positions of all entries with load <= max_load and capacity >= min_capacity, whose squared unit-sphere
+        distance from the point of the Location is at most "squared_radius", in the order of the entries
+    """
+    def within(self, location : dict, squared_radius : float, max_load : float = math.inf, point : tuple = None,
+               min_capacity : float = -math.inf) -> list :
+        if len(self.entries) <= 0 :
+            return []
+        if point is None :
+            point = to_unit_vector(location)
+        found : list = []
+        stack : list = [0]
+        while stack :
+            at = stack.pop()
+            if self.min_load[at] > max_load or self.max_capacity[at] < min_capacity or \
+                    _squared_distance_to_box(point, self.lower[at], self.upper[at]) > squared_radius :
+                continue
+            if self.children[at] :
+                stack.extend(self.children[at])
+                continue
+            for position in self.order[self.begin[at]:self.end[at]] :
+                if self.load[position] <= max_load and self.capacity[position] >= min_capacity and \
+                        _squared_chord(self.points[position], point) <= squared_radius :
+                    found.append(position)
+        return sorted(found)
+
+    """
+        nearest_measured :
+
+        The position of the entry which is nearest to the Location by the argument "distance" function, among the
+        ones (with capacity >= min_capacity and load <= max_load) which are tied with the entry at "position" (see
+        tie_radius). Ties in "distance" are resolved by the order of the entries
+    """
+    def nearest_measured(self, location : dict, position : int, distance, min_capacity : float = -math.inf,
+                         max_load : float = math.inf, point : tuple = None) -> int :
+        if point is None :
+            point = to_unit_vector(location)
+        tied = self.within(location, tie_radius(_squared_chord(self.points[position], point)), max_load, point,
+                           min_capacity)
+        if len(tied) <= 1 :
+            return position
+        return min(tied, key = lambda at : (distance(self.location_of(self.entries[at]), location), at))
+
+    """
+        nearest_least_loaded :
+
+        Among the entries with capacity >= min_capacity, return the position of the nearest one of those with the
+        lowest load, or None. This is the "fewest already assigned first, then by distance" rule of the matching passes.
+        With a "distance" function, ties are measured with it (see nearest_measured)
+    """
+    def nearest_least_loaded(self, location : dict, min_capacity : float = -math.inf, distance = None) :
+        point = to_unit_vector(location)
+        for load in self.load_levels :
+            position = self.nearest(location, min_capacity, load, point)
+            if position is not None :
+                if distance :
+                    position = self.nearest_measured(location, position, distance, min_capacity, load, point)
+                return position
+        return None
+
+"""
+    Function : nearest_neighbour_order
+
+    Description :
+        The order to visit the argument entries (like the deliveries of a pickup) in, going from "start" to the
+        nearest entry not visited yet, and from there to the nearest of the rest, and so on. Yields the positions of
+        the entries, one at a time. Entries with the same name (from name_of) as a visited entry are not visited
+        themselves. Ties in distance are resolved by the order of the entries.
+
+        The Locations of the entries are converted (by to_radians) once, and each step measures the distance to all
+        the entries that are left in one call to distances_from, with the visited entries masked out. With a
+        "distance" function (of two Locations : the one of the entry, and the one it goes from), the entries which
+        are (about) as near as the nearest one are measured with it, and the nearest of those is visited, so that
+        ties come out as they would by measuring every entry with that function
+
+"""
+def nearest_neighbour_order(start : dict, entries : list, location_of = None, name_of = None, distance = None) :
+    if not location_of :
+        location_of = lambda entry : entry[2]
+    if not name_of :
+        name_of = lambda entry : entry[0]['name']
+    coordinates : np.ndarray = to_radians([location_of(entry) for entry in entries])
+    left : np.ndarray = np.ones(len(entries), dtype = bool)
+    positions_by_name : dict = {}
+    for position , entry in enumerate(entries) :
+        positions_by_name.setdefault(name_of(entry), []).append(position)
+    location = start
+    origin = start
+    while left.any() :
+        distances = np.where(left, distances_from(origin, coordinates), np.inf)
+        position = int(np.argmin(distances))
+        if distance :
+            tied = np.flatnonzero(distances <= distances[position] * (1.0 + TIE_SLACK) + TIE_SLACK).tolist()
+            if len(tied) > 1 :
+                position = min(tied, key = lambda at : (distance(location_of(entries[at]), location), at))
+        yield position
+        left[positions_by_name[name_of(entries[position])]] = False
+        location = location_of(entries[position])
+        origin = coordinates[position]
+
+"""
+    Class : CountyGeoIndex
+
+    Description :
+        One GeoIndex for each postcode, over entries grouped by postcode (like sellers_by_postcode and
+        drivers_by_postcode in the CountySnapshot). Entries are identified by the name of their first element (the
+        SellRequest or DriveRequest).
+
+        A search in the whole county goes outward from the postcode of the Location, in rings of neighbouring
+        postcodes : each postcode has a centroid and a radius (in unit-sphere space), and the rings of a postcode are
+        the other postcodes, ordered by the distance between the centroids, minus the radius. The search stops as soon
+        as the best entry found is nearer than the nearest any entry in the next ring can be. The answer is the same
+        as a search through every entry in the county, with ties resolved by the order of the entries in
+        entries_by_postcode. With a "distance" function, ties are measured with it first, like in GeoIndex : the
+        entries which are (about) as near as the nearest one are measured, in every postcode which can hold one.
+
+        The loads of all the entries are kept in one LoadLevels for the county, so that "the lowest load" is known at
+        once, and a postcode holding no entry with a low enough load is passed over without being searched.
+
+"""
+class CountyGeoIndex :
+
+    def __init__(self, entries_by_postcode : dict, capacity_of = None, load_of = None, location_of = None,
+                 distance = None):
+        if not location_of :
+            location_of = lambda entry : entry[2]
+        self.location_of = location_of
+        self.distance = distance
+        self.in_postcode : dict = {}
+        self.positions : dict = {}
+        self.county_offset : dict = {}
+        county_position : int = 0
+        self.load_levels : LoadLevels = LoadLevels()
+        for postcode , entries in entries_by_postcode.items() :
+            entries = [entry for entry in entries if isinstance(entry, list) and len(entry) >= 3]
+            index = GeoIndex(entries, location_of, capacity_of, load_of)
+            for load in index.load :
+                self.load_levels.add(load)
+            self.in_postcode[postcode] = index
+            self.county_offset[postcode] = county_position
+            county_position = county_position + len(entries)
+            for position , entry in enumerate(entries) :
+                self.positions.setdefault(entry[0].get('name', '_'), []).append((index, position))
+
+        # The centroid and radius of each postcode with entries, and the rings around each of them
+        self.postcodes : list = [postcode for postcode , index in self.in_postcode.items() if len(index) > 0]
+        self.ring_number : dict = {postcode : ring for ring , postcode in enumerate(self.postcodes)}
+        self.centroids : list = []
+        self.radius : list = []
+        for postcode in self.postcodes :
+            points = np.array(self.in_postcode[postcode].points)
+            centroid = points.mean(axis = 0)
+            self.centroids.append(tuple(centroid.tolist()))
+            self.radius.append(float(np.sqrt(((points - centroid) ** 2).sum(axis = 1)).max()) * (1.0 + RING_SLACK) + RING_SLACK)
+        self.rings : dict = {}
+        if len(self.postcodes) > 0 :
+            centroids = np.array(self.centroids)
+            between = np.sqrt(((centroids[:, np.newaxis, :] - centroids[np.newaxis, :, :]) ** 2).sum(axis = 2))
+            for origin , postcode in enumerate(self.postcodes) :
+                keys = between[origin] - np.array(self.radius)
+                self.rings[postcode] = [(float(keys[ring]), int(ring)) for ring in np.argsort(keys, kind = 'stable')]
+
+    def __len__(self) :
+        return sum(len(index) for index in self.in_postcode.values())
+
+    def _chord_to_centroid(self, point : tuple, ring : int) -> float :
+        centroid = self.centroids[ring]
+        return math.sqrt((point[0] - centroid[0]) ** 2 + (point[1] - centroid[1]) ** 2 + (point[2] - centroid[2]) ** 2)
+
+    """
+        _rings_from :
+
+        The postcodes to search, as (lower bound of the distance to any entry in it , postcode-number), in the order of
+        the bounds. From a postcode with entries, the bounds come from its rings, otherwise they are measured here
+    """
+    def _rings_from(self, point : tuple, postcode : str) :
+        if postcode in self.rings :
+            origin = self.ring_number[postcode]
+            from_origin = self._chord_to_centroid(point, origin)
+            for key , ring in self.rings[postcode] :
+                yield key - from_origin , ring
+        else :
+            bounds = sorted((self._chord_to_centroid(point, ring) - self.radius[ring], ring) for ring in range(len(self.postcodes)))
+            for bound , ring in bounds :
+                yield bound , ring
+
+    def _nearest_in_rings(self, location : dict, point : tuple, min_capacity : float, max_load : float) :
+        best = None
+        for bound , ring in self._rings_from(point, str(location.get('postcode', '_'))) :
+            if best and bound > 0 and bound * bound > best[0] :
+                break
+            exact_bound = self._chord_to_centroid(point, ring) - self.radius[ring]
+            if best and exact_bound > 0 and exact_bound * exact_bound > best[0] :
+                continue
+            postcode = self.postcodes[ring]
+            index = self.in_postcode[postcode]
+            position = index.nearest(location, min_capacity, max_load, point)
+            if position is None :
+                continue
+            entry_point = index.points[position]
+            squared_distance = (entry_point[0] - point[0]) ** 2 + (entry_point[1] - point[1]) ** 2 + \
+                               (entry_point[2] - point[2]) ** 2
+            found = (squared_distance, self.county_offset[postcode] + position, index.entries[position])
+            if best is None or found[:2] < best[:2] :
+                best = found
+        return best
+
+    """
+        _nearest_measured :
+
+        The entry nearest to the Location by self.distance, among the ones (with capacity >= min_capacity and load
+        <= max_load, in any postcode) which are tied with the best one from _nearest_in_rings
+    """
+    def _nearest_measured(self, location : dict, point : tuple, best : tuple, min_capacity : float, max_load : float) :
+        squared_radius = tie_radius(best[0])
+        radius = math.sqrt(squared_radius)
+        tied : list = []
+        for ring , postcode in enumerate(self.postcodes) :
+            if self._chord_to_centroid(point, ring) - self.radius[ring] > radius :
+                continue
+            index = self.in_postcode[postcode]
+            for position in index.within(location, squared_radius, max_load, point, min_capacity) :
+                tied.append((self.county_offset[postcode] + position, index.entries[position]))
+        if len(tied) <= 1 :
+            return best[2]
+        return min(tied, key = lambda found : (self.distance(self.location_of(found[1]), location), found[0]))[1]
+
+    """
+        nearest_in_postcode / nearest :
+
+        The entry with the lowest load, and then the nearest, which has at least min_capacity. None if no entry fits
+    """
+    def nearest_in_postcode(self, postcode : str, location : dict, min_capacity : float = -math.inf) :
+        index = self.in_postcode.get(postcode)
+        if not index :
+            return None
+        position = index.nearest_least_loaded(location, min_capacity, self.distance)
+        return None if position is None else index.entries[position]
+
+    def nearest(self, location : dict, min_capacity : float = -math.inf) :
+        if len(self.postcodes) <= 0 :
+            return None
+        point = to_unit_vector(location)
+        for load in self.load_levels :
+            best = self._nearest_in_rings(location, point, min_capacity, load)
+            if best :
+                if self.distance :
+                    return self._nearest_measured(location, point, best, min_capacity, load)
+                return best[2]
+        return None
+
+    def refresh(self, name : str) :
+        for index , position in self.positions.get(name, []) :
+            self.load_levels.remove(index.load[position])
+            index.refresh(position)
+            self.load_levels.add(index.load[position])
@@ -0,0 +1,598 @@
+"""
+    File : graph_writes.py
+    Date : 18.10.2026
+    Description :
+
+Contains the write-buffers used by the matching passes in "prepare.py". Instead of writing every relationship and
+every counter-increment to the graph the moment it is decided, the passes collect them in a buffer per county, and
+flush the buffer when the county is done. Counters which are changed many times (like 'num_reserved' on a popular
+SellRequest) are then written only once, with their final value.
+
+Before a buffer writes, it compares its writes with what is already in the graph (see expect), and leaves out the
+ones which would change nothing : a relationship which would be removed and made again between the same nodes, a
+relationship which is already there, and a counter which already has its value. What is left is the actual
+difference, which is counted as added, removed and unchanged relationships (diff_counts). An iteration over a graph
+which has not changed then writes (almost) nothing.
+
+The travels of the routes (see organize_routes in "prepare.py") are collected in a TravelWriteBuffer per county, in
+the same way, and written with one bulk call per kind of travel (TRAVEL_TO_PICKUP and TRAVEL_TO_DELIVER). The
+travels of single drivers can only be removed with the bulk functions (see can_remove_travels).
+
+A flush writes each kind of row (removals, relationships, counters) with one bulk call to graph_funcs, which sends the
+rows as the parameter of a single UNWIND statement. The number of round-trips to the graph per flush is then fixed,
+no matter how many rows there are. With a version of graph_funcs which does not have the bulk functions, the rows are
+written one at a time, with the functions they replace (see write_rows).
+
+"""
+
+# from standard Python
+import hashlib
+
+# from common_library
+from libs.commonlib import graph_funcs
+from libs.commonlib.graph_funcs import insert_reservation , update_num_reserved_for_SellRequest , \
+    update_amount_reserved_for_SellRequest , set_SellRequest_for_BuyRequest_reservation , remove_reservation
+from libs.commonlib.graph_funcs import insert_stagesell , update_num_staged_for_SellRequest , \
+    update_amount_staged_for_SellRequest , remove_staged_sell
+from libs.commonlib.graph_funcs import remove_staged_driver , insert_stagedrive , \
+    update_num_staged_pickups_for_DriveRequest
+from libs.commonlib.graph_funcs import insert_travel_from_to
+
+"""
+    Function : fingerprint
+
+    Description :
+        A fingerprint (hex-string) of a set of relationships, given as {from-name : set of (to-name , ...)}. Two sets
+        holding the same relationships have the same fingerprint, no matter the order they were made in
+
+"""
+def fingerprint(relationships : dict) -> str :
+    digest = hashlib.sha1()
+    for from_name in sorted(relationships.keys()) :
+        for relationship_key in sorted(repr(key) for key in relationships[from_name]) :
+            digest.update(repr(from_name).encode())
+            digest.update(relationship_key.encode())
+    return digest.hexdigest()
+
+"""
+    Function : value_rows
+
+    Description :
+        The argument {node-name : value} as the rows of a bulk update in graph_funcs : [{'name' : .. , 'value' : ..}]
+
+"""
+def value_rows(values : dict) -> list :
+    return [{'name' : name , 'value' : value} for name , value in values.items()]
+
+"""
+    Function : write_rows
+
+    Description :
+        Write the argument rows with the bulk function of graph_funcs named "bulk_name" (called with the
+        "bulk_arguments" first, and the rows last), if graph_funcs has it, or else with "write_row", once per row
+
+"""
+def write_rows(bulk_name : str, rows : list, write_row, *bulk_arguments) :
+    write_in_bulk = getattr(graph_funcs, bulk_name, None)
+    if write_in_bulk :
+        write_in_bulk(*bulk_arguments, rows)
+        return
+    for row in rows :
+        write_row(row)
+
+"""
+    Function : can_remove_travels
+
+    Description :
+        True if graph_funcs can remove the travels (TRAVEL_TO_PICKUP and TRAVEL_TO_DELIVER) of single drivers, with
+        remove_travels_to_pickup and remove_travels_to_deliver. Without them, the travels can only be removed all at
+        once (remove_all_travels), so the iterations can not be incremental (see next_iteration in "prepare.py")
+
+"""
+def can_remove_travels() -> bool :
+    return hasattr(graph_funcs, 'remove_travels_to_pickup') and hasattr(graph_funcs, 'remove_travels_to_deliver')
+
+"""
+    Class : WriteBuffer
+
+    Description :
+        The common part of the buffers below. With flush_every > 0, the buffer flushes itself every time that many
+        relationships have been collected, to put a bound on the memory it uses. With flush_every = 0 (the default)
+        it only flushes when told to
+
+        Each buffer holds one "kind" of relationship, removed by the name of the node it goes from. "meta_keys" are
+        the keys of the relationship_meta which tells two relationships between the same nodes apart (the rest, like
+        'calc_time', is left as it is in the graph). The subclasses name the dict of removals, the list of new
+        relationships, and the dicts of counters they collect (by node-name), so the comparison can be made here
+
+        The buffers of the matching passes also collect the removal of the routes (travels) of the drivers whose
+        deliveries they change (remove_travels), and write those first
+
+"""
+class WriteBuffer :
+
+    kind : str = ''
+    meta_keys : tuple = ()
+    removals_attribute : str = ''
+    relationships_attribute : str = ''
+    counter_attributes : tuple = ()
+
+    def __init__(self, flush_every : int = 0, plan = None):
+        self.flush_every = flush_every
+        self.plan = plan
+        self.existing : dict = None
+        self.existing_counters : dict = {}
+        self.expected : dict = {}
+        self.num_added : int = 0
+        self.num_removed : int = 0
+        self.clear()
+
+    def clear(self) :
+        self.removed_travels : dict = {}
+
+    def num_relationships(self) -> int :
+        return 0
+
+    """
+        remove_travels :
+
+        Remove the route (the TRAVEL_TO_PICKUP and TRAVEL_TO_DELIVER relationships) of the argument driver, when the
+        buffer is written, so that organize_routes makes it again
+    """
+    def remove_travels(self, driveRequest_name : str) :
+        self.removed_travels[driveRequest_name] = True
+
+    def write_removed_travels(self) :
+        if len(self.removed_travels) <= 0 :
+            return
+        if not can_remove_travels() :
+            raise Exception(type(self).__name__ + ' : graph_funcs can not remove the travels of single drivers')
+        graph_funcs.remove_travels_to_pickup(list(self.removed_travels.keys()))
+        graph_funcs.remove_travels_to_deliver(list(self.removed_travels.keys()))
+
+    def travel_removals(self) -> list :
+        return [('travels' , driveRequest_name) for driveRequest_name in self.removed_travels.keys()]
+
+    def _added(self) :
+        if self.flush_every > 0 and self.num_relationships() >= self.flush_every :
+            self.flush()
+
+    def write(self) :
+        pass
+
+    def relationship_key(self, to_name : str, relationship_meta : dict) -> tuple :
+        return (to_name,) + tuple(relationship_meta.get(key) for key in self.meta_keys)
+
+    """
+        expect :
+
+        Tell the buffer what is in the graph before anything is written : the relationships of its kind as
+        (from-name , to-name , relationship_meta), and the counters as {counter : {node-name : value}}. Without
+        this, everything collected is written
+    """
+    def expect(self, relationships : list, counters : dict) :
+        self.existing = {}
+        for from_name , to_name , relationship_meta in relationships :
+            self.existing.setdefault(from_name, set()).add(self.relationship_key(to_name, relationship_meta))
+        self.existing_counters = {counter : dict(values) for counter , values in counters.items()}
+        self.expected = {from_name : set(keys) for from_name , keys in self.existing.items()}
+
+    """
+        reconcile :
+
+        Leave out what would not change the graph : the removal of a node's relationships, together with the new ones
+        from the same node, when they are the same as the ones in the graph, new relationships which are already in
+        the graph, and counters which already has their value (except on nodes whose relationships are removed, as
+        a removal may set their counters back)
+    """
+    def reconcile(self) :
+        if self.existing is None :
+            return
+        removed : dict = getattr(self, self.removals_attribute)
+        relationships : list = getattr(self, self.relationships_attribute)
+        new_keys : dict = {}
+        for from_name , to_name , relationship_meta in relationships :
+            new_keys.setdefault(from_name, set()).add(self.relationship_key(to_name, relationship_meta))
+        kept : dict = {}
+        for from_name in list(removed.keys()) :
+            existing_keys = self.existing.get(from_name)
+            if existing_keys and new_keys.get(from_name) == existing_keys :
+                del removed[from_name]
+                kept[from_name] = True
+        relationships[:] = [
+            relationship for relationship in relationships
+            if not relationship[0] in kept and (relationship[0] in removed or
+                not self.relationship_key(relationship[1], relationship[2]) in self.existing.get(relationship[0], ()))
+        ]
+        for counter in self.counter_attributes :
+            values : dict = getattr(self, counter)
+            existing_values : dict = self.existing_counters.get(counter, {})
+            for name in list(values.keys()) :
+                if not name in removed and name in existing_values and existing_values[name] == values[name] :
+                    del values[name]
+
+    """
+        _written :
+
+        Keep "existing" in line with the graph, after the buffer has been written, and count the difference
+    """
+    def _written(self) :
+        if self.existing is None :
+            return
+        for from_name in getattr(self, self.removals_attribute).keys() :
+            self.num_removed = self.num_removed + len(self.existing.pop(from_name, ()))
+            for existing_values in self.existing_counters.values() :
+                existing_values.pop(from_name, None)
+        for from_name , to_name , relationship_meta in getattr(self, self.relationships_attribute) :
+            self.existing.setdefault(from_name, set()).add(self.relationship_key(to_name, relationship_meta))
+            self.num_added = self.num_added + 1
+        for counter in self.counter_attributes :
+            self.existing_counters.setdefault(counter, {}).update(getattr(self, counter))
+
+    """
+        diff_counts :
+
+        The number of relationships added and removed by the flushes so far, and the number of the expected ones
+        (see expect) which are still in place. "fingerprint" is the fingerprint of the relationships in the graph now
+    """
+    def diff_counts(self) -> dict :
+        if self.existing is None :
+            return {'added' : self.num_added , 'removed' : self.num_removed , 'unchanged' : 0 , 'fingerprint' : ''}
+        unchanged : int = 0
+        for from_name , keys in self.expected.items() :
+            unchanged = unchanged + len(keys & self.existing.get(from_name, set()))
+        return {
+            'added'       : self.num_added ,
+            'removed'     : self.num_removed ,
+            'unchanged'   : unchanged ,
+            'fingerprint' : fingerprint(self.existing)
+        }
+
+    """
+        removals / relationships / updates :
+
+        What write() would do, without doing it : the removals as (kind , name), the new relationships as
+        (kind , from-name , to-name , relationship_meta), and the properties set on nodes as (name , property , value)
+    """
+    def removals(self) -> list :
+        return []
+
+    def relationships(self) -> list :
+        return []
+
+    def updates(self) -> list :
+        return []
+
+    """
+        flush :
+
+        Write everything collected so far, which would change the graph (see reconcile), to the graph, and empty the
+        buffer. Returns the number of rows written. A buffer with a plan (a dry run, see "plan.py") hands the rows to
+        the plan instead of writing them
+    """
+    def flush(self) -> int :
+        self.reconcile()
+        written = len(self)
+        if written > 0 :
+            if self.plan is not None :
+                self.plan.add_writes(self)
+            else :
+                self.write()
+            self._written()
+        self.clear()
+        return written
+
+"""
+    Class : ReservationWriteBuffer
+
+    Description :
+        Collects the reservation-relationships, the reserve-targets of the BuyRequests and the final
+        'num_reserved' / 'amount_reserved' of each SellRequest, for one county. Reservations which are released (in
+        an incremental iteration) are removed before the new ones are inserted, and so are the routes of the drivers
+        of the SellRequests involved. A flush makes at most seven bulk calls
+
+"""
+class ReservationWriteBuffer(WriteBuffer) :
+
+    kind = 'reservation'
+    meta_keys = ('reserved',)
+    removals_attribute = 'removed_reservations'
+    relationships_attribute = 'reservations'
+    counter_attributes = ('num_reserved' , 'amount_reserved' , 'reserve_targets')
+
+    def clear(self) :
+        super().clear()
+        self.removed_reservations : dict = {}
+        self.reservations : list = []
+        self.reserve_targets : dict = {}
+        self.num_reserved : dict = {}
+        self.amount_reserved : dict = {}
+
+    def __len__(self) :
+        return len(self.removed_travels) + len(self.removed_reservations) + len(self.reservations) + \
+               len(self.reserve_targets) + len(self.num_reserved) + len(self.amount_reserved)
+
+    def num_relationships(self) -> int :
+        return len(self.reservations)
+
+    def remove_reservation(self, buyRequest_name : str) :
+        self.removed_reservations[buyRequest_name] = True
+
+    def add_reservation(self, buyRequest_name : str, sellRequest_name : str, relationship_meta : dict) :
+        self.reservations.append((buyRequest_name, sellRequest_name, relationship_meta))
+        self._added()
+
+    def set_reserve_target(self, buyRequest_name : str, sellRequest_name : str) :
+        self.reserve_targets[buyRequest_name] = sellRequest_name
+
+    def set_reserved_counters(self, sellRequest_name : str, num_reserved : int, amount_reserved : float) :
+        self.num_reserved[sellRequest_name] = num_reserved
+        self.amount_reserved[sellRequest_name] = amount_reserved
+
+    def write(self) :
+        self.write_removed_travels()
+        if len(self.removed_reservations) > 0 :
+            write_rows('remove_reservations', list(self.removed_reservations.keys()), remove_reservation)
+        if len(self.reservations) > 0 :
+            write_rows('insert_reservations', [
+                {'buyRequest' : buyRequest_name , 'sellRequest' : sellRequest_name , 'meta' : relationship_meta}
+                for buyRequest_name , sellRequest_name , relationship_meta in self.reservations
+            ], lambda row : insert_reservation(
+                buyReq  = { 'name' : row['buyRequest'] } ,
+                sellReq = { 'name' : row['sellRequest'] } ,
+                relationship_meta = row['meta']
+            ))
+        if len(self.num_reserved) > 0 :
+            write_rows('update_num_reserved_for_SellRequests', value_rows(self.num_reserved),
+                       lambda row : update_num_reserved_for_SellRequest(row['name'], row['value']))
+        if len(self.amount_reserved) > 0 :
+            write_rows('update_amount_reserved_for_SellRequests', value_rows(self.amount_reserved),
+                       lambda row : update_amount_reserved_for_SellRequest(row['name'], row['value']))
+        if len(self.reserve_targets) > 0 :
+            write_rows('set_SellRequest_for_BuyRequest_reservations', value_rows(self.reserve_targets),
+                       lambda row : set_SellRequest_for_BuyRequest_reservation(row['name'], row['value']))
+
+    def removals(self) -> list :
+        return self.travel_removals() + \
+               [('reservation' , buyRequest_name) for buyRequest_name in self.removed_reservations.keys()]
+
+    def relationships(self) -> list :
+        return [('reservation' , buyRequest_name , sellRequest_name , relationship_meta)
+                for buyRequest_name , sellRequest_name , relationship_meta in self.reservations]
+
+    def updates(self) -> list :
+        return [(name , 'num_reserved' , value) for name , value in self.num_reserved.items()] + \
+               [(name , 'amount_reserved' , value) for name , value in self.amount_reserved.items()] + \
+               [(name , 'reserve_target' , value) for name , value in self.reserve_targets.items()]
+
+"""
+    Class : StagedSellWriteBuffer
+
+    Description :
+        Collects the StageSell-relationships of the ordinary sales, and the final 'num_staged' / 'amount_staged' of
+        each SellRequest. A SellRequest which gets many buyers in a row has its counters written once per flush,
+        instead of once per buyer. Released staged sells are removed before the new ones are inserted, and so are the
+        routes of the drivers of the SellRequests involved. A flush makes at most six bulk calls
+
+"""
+class StagedSellWriteBuffer(WriteBuffer) :
+
+    kind = 'staged_sell'
+    meta_keys = ('staged',)
+    removals_attribute = 'removed_staged_sells'
+    relationships_attribute = 'staged_sells'
+    counter_attributes = ('num_staged' , 'amount_staged')
+
+    def clear(self) :
+        super().clear()
+        self.removed_staged_sells : dict = {}
+        self.staged_sells : list = []
+        self.num_staged : dict = {}
+        self.amount_staged : dict = {}
+
+    def __len__(self) :
+        return len(self.removed_travels) + len(self.removed_staged_sells) + len(self.staged_sells) + \
+               len(self.num_staged) + len(self.amount_staged)
+
+    def num_relationships(self) -> int :
+        return len(self.staged_sells)
+
+    def remove_staged_sell(self, buyRequest_name : str) :
+        self.removed_staged_sells[buyRequest_name] = True
+
+    def add_staged_sell(self, buyRequest_name : str, sellRequest_name : str, relationship_meta : dict) :
+        self.staged_sells.append((buyRequest_name, sellRequest_name, relationship_meta))
+        self._added()
+
+    def set_staged_counters(self, sellRequest_name : str, num_staged : int, amount_staged : float) :
+        self.num_staged[sellRequest_name] = num_staged
+        self.amount_staged[sellRequest_name] = amount_staged
+
+    def write(self) :
+        self.write_removed_travels()
+        if len(self.removed_staged_sells) > 0 :
+            write_rows('remove_staged_sells', list(self.removed_staged_sells.keys()), remove_staged_sell)
+        if len(self.staged_sells) > 0 :
+            write_rows('insert_stagesells', [
+                {'buyRequest' : buyRequest_name , 'sellRequest' : sellRequest_name , 'meta' : relationship_meta}
+                for buyRequest_name , sellRequest_name , relationship_meta in self.staged_sells
+            ], lambda row : insert_stagesell(
+                buyReq  = { 'name' : row['buyRequest'] } ,
+                sellReq = { 'name' : row['sellRequest'] } ,
+                relationship_meta = row['meta']
+            ))
+        if len(self.num_staged) > 0 :
+            write_rows('update_num_staged_for_SellRequests', value_rows(self.num_staged),
+                       lambda row : update_num_staged_for_SellRequest(row['name'], row['value']))
+        if len(self.amount_staged) > 0 :
+            write_rows('update_amount_staged_for_SellRequests', value_rows(self.amount_staged),
+                       lambda row : update_amount_staged_for_SellRequest(row['name'], row['value']))
+
+    def removals(self) -> list :
+        return self.travel_removals() + \
+               [('staged_sell' , buyRequest_name) for buyRequest_name in self.removed_staged_sells.keys()]
+
+    def relationships(self) -> list :
+        return [('staged_sell' , buyRequest_name , sellRequest_name , relationship_meta)
+                for buyRequest_name , sellRequest_name , relationship_meta in self.staged_sells]
+
+    def updates(self) -> list :
+        return [(name , 'num_staged' , value) for name , value in self.num_staged.items()] + \
+               [(name , 'amount_staged' , value) for name , value in self.amount_staged.items()]
+
+"""
+    Class : StagedDriveWriteBuffer
+
+    Description :
+        Collects the STAGED_DRIVER removals and insertions of the driver-assignment, and the final
+        'num_staged_pickups' of each DriveRequest. Each driver is removed at most once, no matter how many staged
+        drives it had, and has its pickup-count written once per flush, instead of once per assigned SellRequest.
+        Removals are written before insertions. The routes (travels) of the drivers whose sellers have changed are
+        removed along with them. A flush makes at most five bulk calls
+
+"""
+class StagedDriveWriteBuffer(WriteBuffer) :
+
+    kind = 'staged_drive'
+    removals_attribute = 'removed_drivers'
+    relationships_attribute = 'staged_drives'
+    counter_attributes = ('num_staged_pickups',)
+
+    def clear(self) :
+        super().clear()
+        self.removed_drivers : dict = {}
+        self.staged_drives : list = []
+        self.num_staged_pickups : dict = {}
+
+    def __len__(self) :
+        return len(self.removed_drivers) + len(self.removed_travels) + len(self.staged_drives) + \
+               len(self.num_staged_pickups)
+
+    def num_relationships(self) -> int :
+        return len(self.staged_drives)
+
+    def remove_staged_driver(self, driveRequest_name : str) :
+        self.removed_drivers[driveRequest_name] = True
+
+    def add_staged_drive(self, driveRequest_name : str, sellRequest_name : str, relationship_meta : dict) :
+        self.staged_drives.append((driveRequest_name, sellRequest_name, relationship_meta))
+        self._added()
+
+    def set_staged_pickups(self, driveRequest_name : str, num_staged_pickups : int) :
+        self.num_staged_pickups[driveRequest_name] = num_staged_pickups
+
+    def write(self) :
+        self.write_removed_travels()
+        if len(self.removed_drivers) > 0 :
+            write_rows('remove_staged_drivers', list(self.removed_drivers.keys()), remove_staged_driver)
+        if len(self.staged_drives) > 0 :
+            write_rows('insert_stagedrives', [
+                {'driveRequest' : driveRequest_name , 'sellRequest' : sellRequest_name , 'meta' : relationship_meta}
+                for driveRequest_name , sellRequest_name , relationship_meta in self.staged_drives
+            ], lambda row : insert_stagedrive(
+                driveReq = { 'name' : row['driveRequest'] } ,
+                sellReq  = { 'name' : row['sellRequest'] } ,
+                relationship_meta = row['meta']
+            ))
+        if len(self.num_staged_pickups) > 0 :
+            write_rows('update_num_staged_pickups_for_DriveRequests', value_rows(self.num_staged_pickups),
+                       lambda row : update_num_staged_pickups_for_DriveRequest(row['name'], row['value']))
+
+    def removals(self) -> list :
+        return self.travel_removals() + \
+               [('staged_driver' , driveRequest_name) for driveRequest_name in self.removed_drivers.keys()]
+
+    def relationships(self) -> list :
+        return [('staged_drive' , driveRequest_name , sellRequest_name , relationship_meta)
+                for driveRequest_name , sellRequest_name , relationship_meta in self.staged_drives]
+
+    def updates(self) -> list :
+        return [(name , 'num_staged_pickups' , value) for name , value in self.num_staged_pickups.items()]
+
+"""
+    Class : TravelWriteBuffer
+
+    Description :
+        Collects the TRAVEL_TO_PICKUP and TRAVEL_TO_DELIVER relationships of the routes of one county, as
+        (travel_name , from-name , to-name , relationship_meta) rows, and writes them when flushed, with one bulk
+        call per travel_name, instead of one call per trip. The travels are not compared with the graph : the routes
+        are made again from a graph without travels (see reset_planning_graph in "prepare.py")
+
+"""
+class TravelWriteBuffer(WriteBuffer) :
+
+    kind = 'travel'
+
+    def clear(self) :
+        super().clear()
+        self.travels : list = []
+
+    def __len__(self) :
+        return len(self.travels)
+
+    def num_relationships(self) -> int :
+        return len(self.travels)
+
+    """
+        add_route :
+
+        Collect the travels of the argument route. Returns them
+    """
+    def add_route(self, route : list) -> list :
+        travels = travels_of_route(route)
+        self.travels.extend(travels)
+        self._added()
+        return travels
+
+    def write(self) :
+        write_travels(self.travels)
+
+    def relationships(self) -> list :
+        return list(self.travels)
+
+"""
+    Function : travels_of_route
+
+    Description :
+        The TRAVEL_TO_PICKUP and TRAVEL_TO_DELIVER relationships of a route from organize_routes in "prepare.py", as
+        (travel_name , from-name , to-name , relationship_meta), one per trip
+
+"""
+def travels_of_route(route : list) -> list :
+    travels : list = []
+    for trip in route :
+        travel_name = 'TRAVEL_TO_DELIVER'
+        travel_meta: dict = {
+            'distance'       : trip['distance'],
+            'loaded_before'  : trip['loaded_before'],
+            'loaded_after'   : trip['loaded_after'],
+            'driveRequest'   : trip['driveRequest']['name'],
+            'drive_user_name': trip['drive_user']['name']
+        }
+        if trip['type'] == 'pickup' :
+            travel_name = 'TRAVEL_TO_PICKUP'
+            travel_meta['sellRequest_name'] = trip['sellRequest']['name']
+        else:
+            travel_meta['buyRequest_name'] = trip['buyRequest']['name']
+        travels.append((travel_name, trip['from']['name'], trip['to']['name'], travel_meta))
+    return travels
+
+"""
+    Function : write_travels
+
+    Description :
+        Write the argument travels (from travels_of_route) to the graph, with one bulk call per travel_name
+
+"""
+def write_travels(travels : list) :
+    rows_by_travel_name : dict = {}
+    for travel_name , from_name , to_name , travel_meta in travels :
+        rows_by_travel_name.setdefault(travel_name, []).append(
+            {'from' : from_name , 'to' : to_name , 'meta' : travel_meta})
+    for travel_name , rows in rows_by_travel_name.items() :
+        write_rows('insert_travels_from_to', rows, lambda row : insert_travel_from_to(
+            travel_from       = {'name' : row['from']} ,
+            travel_to         = {'name' : row['to']} ,
+            travel_name       = travel_name ,
+            relationship_meta = row['meta']
+        ), travel_name)
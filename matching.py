@@ -0,0 +1,842 @@
+"""
+    File : matching.py
+    Date : 18.10.2026
+    Description :
+
+Contains the matching of one county at a time, for each of the matching passes in "prepare.py" (reservations,
+ordinary sales and drivers), and the runner which takes a pass through all the counties, either one after another
+or in parallel worker-processes
+
+"""
+
+# from standard Python
+import datetime
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+# from matching_library
+from .snapshot import CountySnapshot , PlanningIteration , available_to_sell
+from .geo import to_radians
+from .assignment import MinCostFlowAssignment , TIME_BUDGET_S
+from .graph_writes import WriteBuffer , ReservationWriteBuffer , StagedSellWriteBuffer , StagedDriveWriteBuffer
+from .changes import ChangeSet
+from .distance_cache import distance_cache
+
+"""
+    Class : ResultList
+
+    Description :
+        Where a county-function puts its results : the requests it matched (add_ok) and the ones it could not match
+        (add_failed). This one keeps them in the lists "ok" and "failed", which as_tuple returns
+
+"""
+class ResultList :
+
+    def __init__(self):
+        self.ok : list = []
+        self.failed : list = []
+
+    def add_ok(self, result) :
+        self.ok.append(result)
+
+    def add_failed(self, result) :
+        self.failed.append(result)
+
+    def as_tuple(self) -> tuple :
+        return self.ok , self.failed
+
+"""
+    Class : ResultCallback
+
+    Description :
+        Hands each result to a function (on_ok / on_failed) as soon as it is known, and keeps only the number of
+        them, so that the results of a pass do not pile up in memory. as_tuple returns empty lists
+
+"""
+class ResultCallback(ResultList) :
+
+    def __init__(self, on_ok = None, on_failed = None):
+        super().__init__()
+        self.on_ok = on_ok
+        self.on_failed = on_failed
+        self.num_ok : int = 0
+        self.num_failed : int = 0
+
+    def add_ok(self, result) :
+        self.num_ok = self.num_ok + 1
+        if self.on_ok :
+            self.on_ok(result)
+
+    def add_failed(self, result) :
+        self.num_failed = self.num_failed + 1
+        if self.on_failed :
+            self.on_failed(result)
+
+"""
+    find_already_reserved :
+
+    If the buyRequest already has a reservation at a specific sell-request, then find that one
+    
+"""
+def find_already_reserved(snapshot : CountySnapshot, buy_location : dict , buyRequest : dict) -> tuple:
+    reserve_target = buyRequest.get('reserve_target' , '')
+    if reserve_target :
+        local_seller = snapshot.seller_named(reserve_target)
+        if local_seller :
+            print('FOUND EXISTING RESERVATION')
+            return True , {
+                'distance' : distance_cache.distance(local_seller[2], buy_location) ,
+                'local_seller' : local_seller
+            }
+    return False , None
+
+"""
+    find_nearest_reservable_in_postcode :
+
+    Based on the argument postcode, locate the nearest reservable seller, which has a capacity to handle the
+    reservation (the required total reservation-amount from the client must be less than the seller capacity).
+    Sellers with the fewest reservations are preferred, and then the nearest of those
+"""
+def find_nearest_reservable_in_postcode(postcode : str, snapshot : CountySnapshot, buy_location : dict, buyRequest : dict) :
+    required_reserve_amount = buyRequest.get('reserved_weeks' , 0) * buyRequest.get('current_requirement' , 0)
+    local_seller = snapshot.reservable_index.nearest_in_postcode(postcode, buy_location, required_reserve_amount)
+    if local_seller :
+        return {
+            'distance': distance_cache.distance(local_seller[2], buy_location),
+            'local_seller': local_seller
+        }
+    return None
+
+"""
+    find_nearest_reservable :
+
+    This is like the function above, only that it searches in the entire collection of sellers
+    
+"""
+def find_nearest_reservable(snapshot : CountySnapshot, buy_location : dict, buyRequest : dict) :
+    required_reserve_amount = buyRequest.get('reserved_weeks', 0) * buyRequest.get('current_requirement', 0)
+    local_seller = snapshot.reservable_index.nearest(buy_location, required_reserve_amount)
+    if local_seller :
+        return {
+            'distance': distance_cache.distance(local_seller[2], buy_location),
+            'local_seller': local_seller
+        }
+    return None
+
+"""
+    release_route_of_seller :
+
+    The route of the driver who picks up from the argument SellRequest (if it has one) no longer delivers what the
+    SellRequest has to deliver : collect the removal of the route in "writes", and forget its pickup in the snapshot,
+    so that organize_routes makes the route again, instead of keeping it as "ALREADY"
+"""
+def release_route_of_seller(snapshot : CountySnapshot, writes : WriteBuffer, sellRequest_name : str) :
+    driver = snapshot.drivers_by_seller.get(sellRequest_name)
+    if driver :
+        writes.remove_travels(driver[0])
+        snapshot.forget_pickups(driver[1])
+
+"""
+    Function : release_changed_reservations
+
+    Description :
+        In an incremental iteration : remove the reservations of the BuyRequests which has changed, so that they are
+        matched again by reserve_in_county. The counters of the SellRequest are set back, except for the amount the
+        buyer will reserve again at its reserve-target (which reserve_in_county does not count a second time), and
+        the route which delivers to the buyer is removed. BuyRequests which are no longer up for matching (like the
+        ones claimed by a driver) keep their reservation
+
+"""
+def release_changed_reservations(snapshot : CountySnapshot, writes : ReservationWriteBuffer) :
+    changes = snapshot.changes
+    if not changes :
+        return
+    changed : set = {existing_reservation[0].get('name' , '_') for existing_reservation in snapshot.reservations
+                     if changes.has_changed('BuyRequest', existing_reservation[0].get('name' , '_'))}
+    if len(changed) <= 0 :
+        return
+    requested : dict = snapshot.requested_buyers('reservation_requests', changed)
+    released : dict = {}
+    for existing_reservation in snapshot.reservations :
+        buyRequestName = existing_reservation[0].get('name' , '_')
+        if not buyRequestName in requested :
+            continue
+        local_seller = snapshot.seller_named(existing_reservation[4].get('name' , '_'))
+        sellRequest = local_seller[0] if local_seller else existing_reservation[4]
+        buyRequest = requested[buyRequestName]
+        reserved_before = existing_reservation[3].get('reserved' , 0)
+        if buyRequest.get('reserve_target' , '') == sellRequest['name'] :
+            reserved_now = buyRequest.get('reserved_weeks', 0) * buyRequest.get('current_requirement', 0)
+            sellRequest['amount_reserved'] = sellRequest.get('amount_reserved', 0) - reserved_before + reserved_now
+        else :
+            sellRequest['num_reserved'] = sellRequest.get('num_reserved', 0) - 1
+            sellRequest['amount_reserved'] = sellRequest.get('amount_reserved', 0) - reserved_before
+        print('\tRELEASED : reservation between BuyRequest(', buyRequestName, ') and SellRequest(', sellRequest['name'], ')')
+        writes.remove_reservation(buyRequestName)
+        writes.set_reserved_counters(sellRequest['name'], sellRequest.get('num_reserved', 0), sellRequest['amount_reserved'])
+        release_route_of_seller(snapshot, writes, sellRequest['name'])
+        snapshot.refresh_seller(sellRequest['name'])
+        released[buyRequestName] = True
+    if len(released) > 0 :
+        snapshot.forget_reservations(released)
+
+"""
+    Function : reserve_in_county
+
+    Description :
+        Create all the reservation relationships between requests-for-reservations and
+        sell-requests with capacity for reservation, within one county. The relationships and counters are collected
+        in "writes", and nothing is written to the graph here. The matched and failed reservation-requests are put in
+        "results" (a ResultList of its own, if none is given), and returned by it
+
+"""
+def reserve_in_county(snapshot : CountySnapshot, calc_time : datetime.datetime, writes : ReservationWriteBuffer,
+                      results : ResultList = None) -> tuple:
+    if results is None :
+        results = ResultList()
+    covered_already_reservations: dict = {}
+
+    release_changed_reservations(snapshot, writes)
+
+    existing_reservations = snapshot.reservations
+    for existing_reservation in existing_reservations :
+        buyRequestName = existing_reservation[0].get('name' , '_')
+        covered_already_reservations[buyRequestName] = existing_reservation
+
+    """
+        Retrieve all the reservations which has not been claimed by a driver yet AND
+        that has not yet been served within the minimum-age
+    """
+    for reservation_request in snapshot.each_buyer('reservation_requests') :
+        buyRequest   = reservation_request[0]
+        buy_location = reservation_request[2]
+        buyRequestName = buyRequest.get('name' , '_')
+        if buyRequestName in covered_already_reservations:
+            already_reservation = covered_already_reservations[buyRequestName]
+            reservation = already_reservation[3]
+            sellRequest = already_reservation[4]
+            results.add_ok(reservation_request)
+
+            print('\tALREADY : reservation between BuyRequest(', buyRequest['name'], ') and SellRequest(',
+                  sellRequest['name'], ') initiated : ', datetime.datetime.utcfromtimestamp(reservation['calc_time']))
+
+            continue
+
+        """
+         1. If the buyer has already registered a reservation on a seller
+            before in an earlier iteration, then we need to load that one, regardless of distance, even
+            though there might now be a seller which is even closer.
+            
+            It also means that the amount reserved that the buyer needs, has already been registered at this
+            seller. So, when we register a new registration on a seller-buyer relationship for the first time ,
+            the identify for that seller must be registered at the buyer, so we can know !
+        """
+        has_already_reserved , reserve_from_this_seller = find_already_reserved(snapshot , buy_location, buyRequest)
+
+        """
+        2. Make a list of reservable sellers within the same postcode as the reservation, sorted by distance
+        """
+        if not reserve_from_this_seller:
+            postcode_key : str = str(buy_location.get('postcode' , '_'))
+            reserve_from_this_seller = find_nearest_reservable_in_postcode(postcode_key, snapshot, buy_location, buyRequest)
+
+        """
+        3. If we didnt find a reservation from the list of sellers within the same postcode as the buyer, then we
+           start looking into nearby postcodes
+        """
+        if not reserve_from_this_seller :
+            reserve_from_this_seller = find_nearest_reservable(snapshot, buy_location, buyRequest)
+
+        """
+        4. If we found an reservable seller for this client, then establish a "Reserve" relationship between the Sell and Buy
+        """
+        if reserve_from_this_seller :
+            covered_already_reservations[buyRequestName] = reservation_request
+            results.add_ok(reservation_request)
+            sellRequest = reserve_from_this_seller['local_seller'][0]
+            reserved_capacity = buyRequest.get('reserved_weeks', 0) * buyRequest.get('current_requirement', 0)
+
+            """
+            Insert the graph-relationship between seller and buyer , so that we can include this buyrequest 
+            in the pickup.
+            """
+            relationship_meta : dict = {
+                'calc_time' : calc_time.timestamp() ,
+                'reserved' : reserved_capacity,
+                'BuyRequest_name' : buyRequest['name'] ,
+                'SellRequest_name' : sellRequest['name']
+            }
+            writes.add_reservation(buyRequest['name'], sellRequest['name'], relationship_meta)
+            snapshot.record_reservation(reservation_request, relationship_meta, sellRequest)
+            release_route_of_seller(snapshot, writes, sellRequest['name'])
+
+            if has_already_reserved :
+                print('\tEXISTING : reservation between BuyRequest(', buyRequest['name'], ') and SellRequest(', sellRequest['name'], ')')
+            else:
+                print('\tNEW : reservation between BuyRequest(', buyRequest['name'], ') and SellRequest(', sellRequest['name'], ')')
+                num_reserved = sellRequest.get('num_reserved' , 0) + 1
+                sellRequest['num_reserved'] = num_reserved
+                amount_reserved = sellRequest.get('amount_reserved', 0) + reserved_capacity
+                sellRequest['amount_reserved'] = amount_reserved
+                writes.set_reserved_counters(sellRequest['name'], num_reserved, amount_reserved)
+                snapshot.refresh_seller(sellRequest['name'])
+                buyRequest['reserve_target'] = sellRequest['name']
+                writes.set_reserve_target(buyRequest ['name'] , sellRequest['name'])
+        else :
+            results.add_failed(reservation_request)
+
+    return results.as_tuple()
+
+"""
+    find_nearest_seller_in_postcode :
+
+    Based on the argument postcode, locate the nearest seller, which has a capacity to handle an
+    ordinary sale (the required total amount from the client must be less than the seller capacity).
+    Sellers with the fewest staged sales are preferred, and then the nearest of those
+"""
+def find_nearest_seller_in_postcode(postcode : str, snapshot : CountySnapshot, buy_location : dict, buyRequest : dict) :
+    required_amount = buyRequest.get('current_requirement' , 0)
+    local_seller = snapshot.sale_index.nearest_in_postcode(postcode, buy_location, required_amount)
+    if local_seller :
+        return {
+            'distance': distance_cache.distance(local_seller[2], buy_location),
+            'local_seller': local_seller
+        }
+    return None
+
+"""
+    find_nearest_seller :
+
+    Locate the nearest seller, which has a capacity to handle an
+    ordinary sale (the required total amount from the client must be less than the seller capacity)
+"""
+def find_nearest_seller(snapshot : CountySnapshot, buy_location : dict, buyRequest : dict) :
+    required_amount = buyRequest.get('current_requirement', 0)
+    local_seller = snapshot.sale_index.nearest(buy_location, required_amount)
+    if local_seller :
+        return {
+            'distance': distance_cache.distance(local_seller[2], buy_location),
+            'local_seller': local_seller
+        }
+    return None
+
+"""
+    Function : release_changed_staged_sells
+
+    Description :
+        In an incremental iteration : remove the staged sells of the BuyRequests which has changed, and of the
+        BuyRequests staged at a SellRequest which has changed, so that they are matched again by stage_sales_in_county.
+        The counters of the SellRequests are set back accordingly, and the routes which deliver to the buyers are
+        removed. BuyRequests which are no longer up for matching keep their staged sell
+
+"""
+def release_changed_staged_sells(snapshot : CountySnapshot, writes : StagedSellWriteBuffer) :
+    changes = snapshot.changes
+    if not changes :
+        return
+    changed : set = {existing_staged_sell[0].get('name' , '_') for existing_staged_sell in snapshot.staged_sells
+                     if changes.has_changed('BuyRequest', existing_staged_sell[0].get('name' , '_'))
+                     or changes.has_changed('SellRequest', existing_staged_sell[4].get('name' , '_'))}
+    if len(changed) <= 0 :
+        return
+    requested : dict = snapshot.requested_buyers('ordinary_requests', changed)
+    released : dict = {}
+    for existing_staged_sell in snapshot.staged_sells :
+        buyRequestName = existing_staged_sell[0].get('name' , '_')
+        sellRequestName = existing_staged_sell[4].get('name' , '_')
+        if not buyRequestName in requested :
+            continue
+        local_seller = snapshot.seller_named(sellRequestName)
+        sellRequest = local_seller[0] if local_seller else existing_staged_sell[4]
+        sellRequest['num_staged'] = sellRequest.get('num_staged', 0) - 1
+        sellRequest['amount_staged'] = sellRequest.get('amount_staged', 0) - existing_staged_sell[3].get('staged', 0)
+        print('\tRELEASED : sell between BuyRequest(', buyRequestName, ') and SellRequest(', sellRequestName, ')')
+        writes.remove_staged_sell(buyRequestName)
+        writes.set_staged_counters(sellRequestName, sellRequest['num_staged'], sellRequest['amount_staged'])
+        release_route_of_seller(snapshot, writes, sellRequestName)
+        snapshot.refresh_seller(sellRequestName)
+        released[buyRequestName] = True
+    if len(released) > 0 :
+        snapshot.forget_staged_sells(released)
+
+"""
+    find_seller_for :
+
+    The seller for an ordinary sale : the nearest one with the fewest staged sales within the postcode of the buyer,
+    or else within the whole county. None if no seller has capacity for it
+"""
+def find_seller_for(snapshot : CountySnapshot, sell_request : list) :
+    buyRequest   = sell_request[0]
+    buy_location = sell_request[2]
+    postcode_key : str = str(buy_location.get('postcode' , '_'))
+    buy_from_this_seller = find_nearest_seller_in_postcode(postcode_key, snapshot, buy_location, buyRequest)
+    if not buy_from_this_seller :
+        buy_from_this_seller = find_nearest_seller(snapshot, buy_location, buyRequest)
+    return buy_from_this_seller
+
+"""
+    stage_sale :
+
+    Establish a "StageSale" relationship between the buyer (a [BuyRequest, user, Location] list) and the seller (a
+    [SellRequest, user, Location] list) : collect it in "writes", record it in the snapshot, and count it at the seller.
+    The route of the seller's driver does not deliver to the buyer yet, so it is removed to be made again
+"""
+def stage_sale(snapshot : CountySnapshot, calc_time : datetime.datetime, writes : StagedSellWriteBuffer,
+               sell_request : list, local_seller : list) :
+    buyRequest = sell_request[0]
+    sellRequest = local_seller[0]
+    current_requirement = buyRequest.get('current_requirement', 0)
+    print('\tNEW : sell between BuyRequest(', buyRequest['name'], ') and SellRequest(', sellRequest['name'], ')')
+    relationship_meta: dict = {
+        'calc_time': calc_time.timestamp(),
+        'staged': current_requirement,
+        'BuyRequest_name': buyRequest['name'],
+        'SellRequest_name': sellRequest['name']
+    }
+    snapshot.record_staged_sell(sell_request, relationship_meta, sellRequest)
+    num_staged = sellRequest.get('num_staged', 0) + 1
+    sellRequest['num_staged'] = num_staged
+    amount_staged = sellRequest.get('amount_staged', 0) + current_requirement
+    sellRequest['amount_staged'] = amount_staged
+    snapshot.refresh_seller(sellRequest['name'])
+    writes.set_staged_counters(sellRequest['name'], num_staged, amount_staged)
+    writes.add_staged_sell(buyRequest['name'], sellRequest['name'], relationship_meta)
+    release_route_of_seller(snapshot, writes, sellRequest['name'])
+
+"""
+    Function : stage_sales_in_county
+
+    Description :
+        Create all the staged-sell relationships between the ordinary (non-reserved) buy-requests and
+        sell-requests with capacity left, within one county. The relationships and counters are collected
+        in "writes", and the results in "results", as for reserve_in_county
+
+"""
+def stage_sales_in_county(snapshot : CountySnapshot, calc_time : datetime.datetime, writes : StagedSellWriteBuffer,
+                          results : ResultList = None) -> tuple:
+    if results is None :
+        results = ResultList()
+    covered_already_sales: dict = {}
+
+    release_changed_staged_sells(snapshot, writes)
+
+    existing_staged_sells = snapshot.staged_sells
+    for existing_staged_sell in existing_staged_sells :
+        buyRequestName = existing_staged_sell[0].get('name' , '_')
+        covered_already_sales[buyRequestName] = existing_staged_sell
+
+    """
+    Retrieve all the sales which has not been claimed by a driver yet AND
+    that has not yet been served within the minimum-age  
+    """
+    for sell_request in snapshot.each_buyer('ordinary_requests'):
+        buyRequest     = sell_request[0]
+        buyRequestName = buyRequest.get('name', '_')
+        if buyRequestName in covered_already_sales:
+            already_staged_sell = covered_already_sales[buyRequestName]
+            staged_sell = already_staged_sell[3]
+            sellRequest = already_staged_sell[4]
+            results.add_ok(sell_request)
+
+            print('\tALREADY : sell between BuyRequest(', buyRequest['name'], ') and SellRequest(',
+                  sellRequest['name'], ') initiated : ', datetime.datetime.utcfromtimestamp(staged_sell['calc_time']))
+            continue
+
+        """
+        1. Find the seller within the same postcode as the buyer, or else anywhere in the county
+           (see find_seller_for)
+        """
+        buy_from_this_seller = find_seller_for(snapshot, sell_request)
+
+        """
+        2. If we found an seller for this client, then establish a "StageSale" relationship between the Sell and Buy
+        """
+        if buy_from_this_seller :
+            results.add_ok(sell_request)
+            covered_already_sales[buyRequestName] = sell_request
+            stage_sale(snapshot, calc_time, writes, sell_request, buy_from_this_seller['local_seller'])
+        else:
+            results.add_failed(sell_request)
+
+    return results.as_tuple()
+
+"""
+    Function : stage_sales_by_flow_in_county
+
+    Description :
+        The same as stage_sales_in_county, only that the buyers are matched all at once, by a min-cost-flow
+        assignment (see "assignment.py"), which minimizes the total distance between buyers and sellers, instead of
+        one buyer at a time. The buyers which the assignment could not place (or which it did not get to within
+        the time-budget) are matched one by one afterwards, like in stage_sales_in_county
+
+"""
+def stage_sales_by_flow_in_county(snapshot : CountySnapshot, calc_time : datetime.datetime, writes : StagedSellWriteBuffer,
+                                  results : ResultList = None, time_budget : float = TIME_BUDGET_S) -> tuple:
+    if results is None :
+        results = ResultList()
+    covered_already_sales: dict = {}
+
+    release_changed_staged_sells(snapshot, writes)
+
+    for existing_staged_sell in snapshot.staged_sells :
+        covered_already_sales[existing_staged_sell[0].get('name' , '_')] = existing_staged_sell
+
+    pending : list = []
+    pending_names : dict = {}
+    repeated : list = []
+    for sell_request in snapshot.each_buyer('ordinary_requests') :
+        buyRequest     = sell_request[0]
+        buyRequestName = buyRequest.get('name', '_')
+        if buyRequestName in covered_already_sales :
+            already_staged_sell = covered_already_sales[buyRequestName]
+            results.add_ok(sell_request)
+            print('\tALREADY : sell between BuyRequest(', buyRequest['name'], ') and SellRequest(',
+                  already_staged_sell[4]['name'], ') initiated : ',
+                  datetime.datetime.utcfromtimestamp(already_staged_sell[3]['calc_time']))
+        elif buyRequestName in pending_names :
+            repeated.append(sell_request)
+        else :
+            pending_names[buyRequestName] = True
+            pending.append(sell_request)
+
+    local_sellers : list = [local_seller for local_sellers in snapshot.sellers_by_postcode.values()
+                            for local_seller in local_sellers if isinstance(local_seller, list) and len(local_seller) >= 3]
+    assigned : list = [-1] * len(pending)
+    if len(pending) > 0 and len(local_sellers) > 0 :
+        assignment = MinCostFlowAssignment(
+            buyer_coordinates  = to_radians([sell_request[2] for sell_request in pending]) ,
+            demands            = [sell_request[0].get('current_requirement', 0) for sell_request in pending] ,
+            seller_coordinates = to_radians([local_seller[2] for local_seller in local_sellers]) ,
+            capacities         = [available_to_sell(local_seller) for local_seller in local_sellers]
+        )
+        assigned = assignment.solve(time_budget)
+        print('\tFLOW : ', snapshot.county, ' : ', assignment.stats)
+
+    left_for_greedy : list = []
+    for sell_request , seller in zip(pending, assigned) :
+        if seller >= 0 :
+            results.add_ok(sell_request)
+            covered_already_sales[sell_request[0]['name']] = sell_request
+            stage_sale(snapshot, calc_time, writes, sell_request, local_sellers[seller])
+        else :
+            left_for_greedy.append(sell_request)
+
+    for sell_request in left_for_greedy + repeated :
+        buyRequestName = sell_request[0].get('name', '_')
+        if buyRequestName in covered_already_sales :
+            results.add_ok(sell_request)
+            continue
+        buy_from_this_seller = find_seller_for(snapshot, sell_request)
+        if buy_from_this_seller :
+            results.add_ok(sell_request)
+            covered_already_sales[buyRequestName] = sell_request
+            stage_sale(snapshot, calc_time, writes, sell_request, buy_from_this_seller['local_seller'])
+        else :
+            results.add_failed(sell_request)
+
+    return results.as_tuple()
+
+"""
+    find_nearest_driver_in_postcode
+
+    The driver with the fewest staged pickups within the postcode, and then the nearest of those
+"""
+def find_nearest_driver_in_postcode(postcode: str, snapshot: CountySnapshot, sell_location: dict):
+    local_driver = snapshot.driver_index.nearest_in_postcode(postcode, sell_location)
+    if local_driver:
+        return {
+            'distance': distance_cache.distance(local_driver[2], sell_location),
+            'local_driver': local_driver
+        }
+    return None
+
+"""
+    find_nearest_driver
+
+    The driver with the fewest staged pickups within the county, and then the nearest of those
+"""
+def find_nearest_driver(snapshot: CountySnapshot, sell_location: dict):
+    local_driver = snapshot.driver_index.nearest(sell_location)
+    if local_driver:
+        return {
+            'distance': distance_cache.distance(local_driver[2], sell_location),
+            'local_driver': local_driver
+        }
+    return None
+
+"""
+    Function : assign_drivers_in_county
+
+    Description :
+        Assign a driver to every sell-request within one county. The removal of the existing STAGED_DRIVER
+        relationships, and the new ones and pickup-counts, are collected in "writes", along with the removal of the
+        routes of the drivers whose sellers have changed
+
+"""
+def assign_drivers_in_county(snapshot : CountySnapshot, calc_time : datetime.datetime, writes : StagedDriveWriteBuffer,
+                             results : ResultList = None) -> tuple:
+    if results is None :
+        results = ResultList()
+    covered_already: dict = {}
+    previous_sellers : dict = snapshot.sellers_by_driver()
+
+    existing_staged_drives = snapshot.staged_drives
+    for existing_staged_drive in existing_staged_drives:
+        driveRequestName = existing_staged_drive[0].get('name', '_')
+
+        """
+        Every time we run the assign_sellRequests_to_driveRequests algorithm, we need to remove the
+        STAGED_DRIVER relationships which are already existing. This is because we need to allow
+        potential changes in the sell-request to influent the sales-to-driver distributions
+        """
+        writes.remove_staged_driver(driveRequestName)
+
+    """
+    The drivers are assigned as if the removals had reached the graph. Those which get the same sellers as before
+    keep their STAGED_DRIVER relationships (see reconcile in "graph_writes.py")
+    """
+    snapshot.forget_staged_drives()
+
+    sellRequests = snapshot.sell_requests
+
+    """
+    1. First try to find a driver for the sellrequest within the same postcode
+    """
+    found_no_local_drivers: list = []
+    for sellreq in sellRequests:
+        sellRequest = sellreq[0]
+        sell_location = sellreq[2]
+        sellRequestName = sellRequest.get('name', '_')
+        if sellRequestName in covered_already:
+            driveRequest = covered_already[sellRequestName][0]
+            print('\tALREADY : drive between driveRequest(', driveRequest['name'], ') and SellRequest(',
+                  sellRequest['name'], ')')
+            continue
+
+        postcode_key: str = str(sell_location.get('postcode', '_'))
+        drive_to_this_seller = find_nearest_driver_in_postcode(postcode_key, snapshot, sell_location)
+        if drive_to_this_seller:
+            covered_already[sellRequestName] = drive_to_this_seller['local_driver']
+            driveRequest = drive_to_this_seller['local_driver'][0]
+            print('\tNEW : drive between driveRequest(', driveRequest['name'], ') and SellRequest(',
+                  sellRequest['name'], ')')
+            results.add_ok({
+                'driveRequest': driveRequest,
+                'sellRequest': sellRequest
+            })
+            num_staged_pickups = driveRequest.get('num_staged_pickups', 0) + 1
+            driveRequest['num_staged_pickups'] = num_staged_pickups
+            snapshot.refresh_driver(driveRequest['name'])
+            writes.set_staged_pickups(driveRequest['name'], num_staged_pickups)
+            writes.add_staged_drive(driveRequest['name'], sellRequest['name'], {
+                'calc_time': calc_time.timestamp(),
+                'DriveRequest_name': driveRequest['name'],
+                'SellRequest_name': sellRequest['name']
+            })
+            snapshot.record_staged_drive(drive_to_this_seller['local_driver'], sellreq)
+        else:
+            found_no_local_drivers.append(sellreq)
+
+    """
+    2. For the sell-requests which had no driver nearby (same postcode), find drivers within same COUNTY
+    """
+    for sellreq in found_no_local_drivers:
+        sellRequest = sellreq[0]
+        sell_location = sellreq[2]
+        sellRequestName = sellRequest.get('name', '_')
+        if sellRequestName in covered_already:
+            driveRequest = covered_already[sellRequestName][0]
+            print('\tALREADY : drive between driveRequest(', driveRequest['name'], ') and SellRequest(',
+                  sellRequest['name'], ')')
+            continue
+
+        drive_to_this_seller = find_nearest_driver(snapshot, sell_location)
+        if drive_to_this_seller:
+            covered_already[sellRequestName] = drive_to_this_seller['local_driver']
+            driveRequest = drive_to_this_seller['local_driver'][0]
+            print('\tNEW : drive between driveRequest(', driveRequest['name'], ') and SellRequest(',
+                  sellRequest['name'], ')')
+            results.add_ok({
+                'driveRequest': driveRequest,
+                'sellRequest': sellRequest
+            })
+            num_staged_pickups = driveRequest.get('num_staged_pickups', 0) + 1
+            driveRequest['num_staged_pickups'] = num_staged_pickups
+            snapshot.refresh_driver(driveRequest['name'])
+            writes.set_staged_pickups(driveRequest['name'], num_staged_pickups)
+            writes.add_staged_drive(driveRequest['name'], sellRequest['name'], {
+                'calc_time': calc_time.timestamp(),
+                'DriveRequest_name': driveRequest['name'],
+                'SellRequest_name': sellRequest['name']
+            })
+            snapshot.record_staged_drive(drive_to_this_seller['local_driver'], sellreq)
+        else:
+            results.add_failed({
+                'driveRequest': 0,
+                'sellRequest': sellRequest
+            })
+
+    """
+    3. The drivers which got another set of sellers than before lose their routes (the TRAVEL_TO_PICKUP and
+       TRAVEL_TO_DELIVER relationships), so that organize_routes makes them again. Without a CLEAN_RUNS reset, the old
+       routes would otherwise stay in the graph
+    """
+    assigned_sellers : dict = snapshot.sellers_by_driver()
+    for driveRequest_name , (home_name , sellRequest_names) in previous_sellers.items() :
+        if assigned_sellers.get(driveRequest_name, (home_name , set()))[1] != sellRequest_names :
+            writes.remove_travels(driveRequest_name)
+            snapshot.forget_pickups(home_name)
+
+    return results.as_tuple()
+
+"""
+    The county-function and write-buffer of each pass, and the kinds of request it depends on. In an incremental
+    iteration, a pass only visits the counties where one of those has changed
+"""
+COUNTY_PASSES : dict = {
+    'reservations'   : (reserve_in_county        , ReservationWriteBuffer , ('BuyRequest' , 'SellRequest' )) ,
+    'ordinary_sales' : (stage_sales_in_county    , StagedSellWriteBuffer  , ('BuyRequest' , 'SellRequest' )) ,
+    'ordinary_sales_flow' : (stage_sales_by_flow_in_county , StagedSellWriteBuffer , ('BuyRequest' , 'SellRequest')) ,
+    'drivers'        : (assign_drivers_in_county , StagedDriveWriteBuffer , ('SellRequest', 'DriveRequest'))
+}
+
+"""
+    The pass for the ordinary sales, by the engine doing the matching
+"""
+SALES_ENGINES : dict = {
+    'greedy' : 'ordinary_sales' ,
+    'flow'   : 'ordinary_sales_flow'
+}
+
+"""
+    Function : match_county
+
+    Description :
+        Run one of the COUNTY_PASSES on one county. Returns the ok- and failed-lists (of "results", if given), and the
+        write-buffer holding what is still to be written to the graph (or to the plan of the snapshot, in a dry run).
+        The write-buffer knows what the graph holds before the pass, and only writes the difference
+
+"""
+def match_county(county_pass : str, snapshot : CountySnapshot, calc_time : datetime.datetime, flush_every : int = 0,
+                 results : ResultList = None) -> tuple:
+    county_function , buffer_class , _ = COUNTY_PASSES[county_pass]
+    writes = buffer_class(flush_every, snapshot.plan)
+    writes.expect(*snapshot.existing_relationships(writes.kind))
+    ok , failed = county_function(snapshot, calc_time, writes, results)
+    return ok , failed , writes
+
+"""
+    Function : match_county_in_passes
+
+    Description :
+        Run several of the COUNTY_PASSES, one after another, on the same snapshot of one county. Returns one
+        (ok , failed , writes) per pass. The writes of a pass are flushed before the next pass starts, unless
+        "flush" is False (then the caller must flush them in order). "sinks" holds the ResultList of each pass
+
+"""
+def match_county_in_passes(county_passes : tuple, snapshot : CountySnapshot, calc_time : datetime.datetime,
+                           flush_every : int = 0, flush : bool = True, sinks : list = None) -> list:
+    results : list = []
+    for pass_index , county_pass in enumerate(county_passes) :
+        ok , failed , writes = match_county(county_pass, snapshot, calc_time, flush_every,
+                                            sinks[pass_index] if sinks else None)
+        if flush :
+            writes.flush()
+        results.append((ok , failed , writes))
+    return results
+
+"""
+    _match_county_in_worker :
+
+    Match one county in a worker-process. Returns the results of the passes, and the counties of the requests the
+    snapshot has loaded, for the county_of of the iteration
+"""
+def _match_county_in_worker(county_passes : tuple, county : str, calc_time : datetime.datetime, changes : ChangeSet,
+                            stream_buyers : bool, flush_every : int) -> tuple:
+    snapshot = CountySnapshot(county, calc_time, changes, stream_buyers = stream_buyers)
+    county_results = match_county_in_passes(county_passes, snapshot, calc_time, flush_every, flush = False)
+    return county_results , snapshot.county_of
+
+"""
+    count_diff :
+
+    Add the relationships the argument (flushed) write-buffer added, removed and left unchanged in a county to "diff",
+    and print them
+"""
+def count_diff(diff : dict, county_pass : str, county : str, writes : WriteBuffer) :
+    counts = writes.diff_counts()
+    for key in ('added' , 'removed' , 'unchanged') :
+        diff[key] = diff[key] + counts[key]
+    print('\tGRAPH : ', county_pass, ' in county(', county, ') added ', counts['added'], ' , removed ',
+          counts['removed'], ' , unchanged ', counts['unchanged'], ' : ', counts['fingerprint'])
+
+"""
+    Function : match_all_counties_in_passes
+
+    Description :
+        Run several of the COUNTY_PASSES on every county in the iteration, visiting each county only once : all the
+        passes are done on one county, on the same snapshot, before going to the next. Returns one (ok , failed)
+        tuple per pass, holding the results from all the counties.
+
+        The results of each pass go to its ResultList in "sinks" (by default, a new ResultList per pass), as they
+        come. With ResultCallbacks, they are handed on instead of being kept, and the returned lists are empty
+
+        With workers > 1, the counties are matched in a pool of (at most) that many worker-processes. Each worker
+        loads its own county from the graph, and hands back its ok- and failed-lists, its pending writes, and the
+        counties of the requests it has loaded (added to the county_of of the iteration). The pending writes are
+        flushed here in county-order, so the outcome does not depend on which worker finished first. With
+        "flush_every", a worker also flushes its full buffers itself, which only touches the nodes of its own county.
+        The snapshots of those counties are dropped from the iteration afterwards, so that later passes load them
+        again, with the new writes included
+
+        In an incremental iteration, only the counties with changes that the passes depend on are visited (see
+        dirty_county_names in "snapshot.py"). The number of relationships each pass added, removed and left unchanged
+        in the graph is printed, by county and in total
+
+        A dry run (an iteration with a plan) is always matched here, in this process : the worker-processes hand
+        their results on through the graph, which a dry run leaves untouched
+
+"""
+def match_all_counties_in_passes(county_passes : tuple, iteration : PlanningIteration, calc_time : datetime.datetime,
+                                 workers : int = 0, flush_every : int = 0, sinks : list = None) -> list:
+    if not sinks :
+        sinks = [ResultList() for _ in county_passes]
+    kinds : tuple = tuple({kind : True for county_pass in county_passes for kind in COUNTY_PASSES[county_pass][2]})
+    county_names = iteration.dirty_county_names(kinds)
+    diffs : list = [{'added' : 0 , 'removed' : 0 , 'unchanged' : 0} for _ in county_passes]
+    if workers > 1 and len(county_names) > 1 and iteration.plan is None :
+        with ProcessPoolExecutor(max_workers = min(workers, len(county_names))) as pool :
+            results = pool.map(_match_county_in_worker, repeat(tuple(county_passes)), county_names, repeat(calc_time),
+                               repeat(iteration.changes), repeat(iteration.stream_buyers), repeat(flush_every))
+            for county , (county_results , county_of) in zip(county_names, results) :
+                iteration.county_of.update(county_of)
+                for pass_index , (ok , failed , writes) in enumerate(county_results) :
+                    writes.flush()
+                    for result in ok :
+                        sinks[pass_index].add_ok(result)
+                    for result in failed :
+                        sinks[pass_index].add_failed(result)
+                    count_diff(diffs[pass_index], county_passes[pass_index], county, writes)
+                iteration.discard(county)
+    else :
+        for snapshot in iteration.snapshots(kinds) :
+            county_results = match_county_in_passes(county_passes, snapshot, calc_time, flush_every, sinks = sinks)
+            for pass_index , (_ , _ , writes) in enumerate(county_results) :
+                count_diff(diffs[pass_index], county_passes[pass_index], snapshot.county, writes)
+    for county_pass , diff in zip(county_passes, diffs) :
+        print('#\tGraph writes of ', county_pass, ' : added ', diff['added'], ' , removed ', diff['removed'],
+              ' , unchanged ', diff['unchanged'])
+    return [sink.as_tuple() for sink in sinks]
+
+"""
+    Function : match_all_counties
+
+    Description :
+        Run one of the COUNTY_PASSES on every county in the iteration, and write the results to the graph. See
+        match_all_counties_in_passes ("results" is the ResultList of the pass)
+
+"""
+def match_all_counties(county_pass : str, iteration : PlanningIteration, calc_time : datetime.datetime,
+                       workers : int = 0, flush_every : int = 0, results : ResultList = None) -> tuple:
+    return match_all_counties_in_passes((county_pass,), iteration, calc_time, workers, flush_every,
+                                        [results] if results is not None else None)[0]
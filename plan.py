@@ -0,0 +1,142 @@
+"""
+    File : plan.py
+    Date : 18.10.2026
+    Description :
+
+Contains the PlanningPlan, used for a dry run of the planning : everything the organize_* functions in "prepare.py"
+would write to the graph is collected in the plan instead, in the order it would have been written, and nothing is
+written until the plan is applied. This makes it possible to time the matching on its own, to look at what a change
+to the matching would do, and to throw a plan away.
+
+A dry run is made by giving the PlanningIteration a plan :
+
+    plan = PlanningPlan(calc_time)
+    iteration = PlanningIteration(calc_time, plan = plan)
+    organize_sales(calc_time, iteration)
+    organize_drivers(calc_time, iteration)
+    organize_routes(calc_time, iteration)
+    plan.apply()
+
+(or plan_iteration in "prepare.py", which does the same, before apply()).
+
+"""
+
+# from standard Python
+import copy
+import datetime
+
+"""
+    Class : PlanningPlan
+
+    Description :
+        The steps of a planning iteration, in order : the reset of the planning graph (when CLEAN_RUNS), and the
+        write-buffers of the matching passes and of the travels of the routes (as they were flushed). "results" holds
+        the (ok , failed) tuples of the passes, by the name of the pass, to hand to the handle_failed_* functions in
+        "actions.py" once the plan is applied.
+
+        While the plan is made, the snapshots of the iteration read the graph as if the plan had been applied so far
+        (see "plan" in CountySnapshot)
+
+"""
+class PlanningPlan :
+
+    def __init__(self, calc_time : datetime.datetime = None):
+        if not calc_time :
+            calc_time = datetime.datetime.utcnow()
+        self.calc_time = calc_time
+        self.steps : list = []
+        self.reset : bool = False
+        self.released_drivers : set = set()
+        self.results : dict = {}
+        self.pickups_from : set = set()
+        self.updated : dict = {}
+        self.applied : bool = False
+
+    """
+        add_reset :
+
+        The graph is to be reset (by the argument function) before anything else is written, and the argument
+        drivers released from quarantine. From now on, the snapshots read the graph as if it was
+    """
+    def add_reset(self, reset_function, released_drivers = ()) :
+        self.reset = True
+        self.released_drivers.update(released_drivers)
+        self.steps.append(('reset' , reset_function))
+
+    """
+        add_writes :
+
+        Keep what the argument write-buffer holds now. The buffer is cleared by its flush afterwards, so the plan keeps
+        a copy which still holds the rows
+    """
+    def add_writes(self, writes) :
+        planned_writes = copy.copy(writes)
+        planned_writes.plan = None
+        self.steps.append(('writes' , planned_writes))
+        for name , key , value in planned_writes.updates() :
+            self.updated.setdefault(name, {})[key] = value
+        for travel_name , from_name , _ , _ in planned_writes.relationships() :
+            if travel_name == 'TRAVEL_TO_PICKUP' :
+                self.pickups_from.add(from_name)
+
+    """
+        as_written :
+
+        The argument node (dict), as it would be read from the graph after the properties set so far in the plan
+    """
+    def as_written(self, node : dict) -> dict :
+        updated = self.updated.get(node.get('name', '_'))
+        if not updated :
+            return node
+        return {**node, **updated}
+
+    def has_pickup_from(self, location_name : str) -> bool :
+        return location_name in self.pickups_from
+
+    """
+        removals / relationships / updates :
+
+        Everything the plan would remove, the relationships it would make, and the properties it would set on the
+        nodes (like the counters of the SellRequests), in the layout of the same methods of the write-buffers
+    """
+    def removals(self) -> list :
+        return [removal for kind , step in self.steps if kind == 'writes' for removal in step.removals()]
+
+    def relationships(self) -> list :
+        return [relationship for kind , step in self.steps if kind == 'writes' for relationship in step.relationships()]
+
+    def updates(self) -> list :
+        return [update for kind , step in self.steps if kind == 'writes' for update in step.updates()]
+
+    """
+        summary :
+
+        The number of removals, relationships and updates, by kind
+    """
+    def summary(self) -> dict :
+        summary : dict = {'reset' : self.reset}
+        for removal in self.removals() :
+            key = 'remove_' + removal[0]
+            summary[key] = summary.get(key, 0) + 1
+        for relationship in self.relationships() :
+            summary[relationship[0]] = summary.get(relationship[0], 0) + 1
+        for update in self.updates() :
+            summary[update[1]] = summary.get(update[1], 0) + 1
+        return summary
+
+    """
+        apply :
+
+        Write the plan to the graph, step by step, in the order the steps were planned. A plan can only be applied
+        once. Returns the number of steps
+    """
+    def apply(self) -> int :
+        if self.applied :
+            raise Exception('PlanningPlan.apply : the plan has already been applied')
+        self.applied = True
+        for kind , step in self.steps :
+            if kind == 'reset' :
+                step()
+            elif kind == 'writes' :
+                step.write()
+        return len(self.steps)
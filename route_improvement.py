@@ -0,0 +1,242 @@
+"""
+    File : route_improvement.py
+    Date : 18.10.2026
+    Description :
+
+Contains the improvement of the routes made by organize_routes in "prepare.py". Those routes are made in one greedy
+pass : the pickups of a driver in the order of their distance from the home of the driver, and the deliveries of each
+pickup in nearest-neighbour order, before going on to the next pickup. Here, a route is shortened afterwards by local
+search, with three kinds of moves :
+
+    2-opt      : a stretch of the route is driven in the opposite direction
+    Or-opt     : a stretch of two or three stops is moved to another place in the route
+    relocation : one stop (a pickup or a delivery) is moved to another place in the route
+
+A move is only made if every pickup still comes before all the deliveries of its SellRequest, so that the driver never
+delivers what has not been picked up yet. The route is open : it starts at the home of the driver, and ends at the last
+delivery. The distances between the stops come from one (vectorized) distance-matrix per route, and all the moves of
+a kind are measured at once, from it. Each round makes the move which shortens the route the most, until no move
+shortens it, or the time-budget of the route has run out.
+
+"""
+
+# from standard Python
+import time
+
+# other stuff
+import numpy as np
+
+# from matching_library
+from .geo import to_radians , distance_matrix
+from .distance_cache import distance_cache
+
+ROUTE_TIME_BUDGET_S : float = 0.5
+MAX_SEGMENT : int = 3
+MIN_GAIN_KM : float = 1e-9
+
+"""
+    Class : RouteImprovement
+
+    Description :
+        The local search over the order of the stops of one route (a list of trips, as made by organize_routes).
+        Create it, call improve(), and read "order" : the stops (1 for the first trip, 2 for the second, ...) in the
+        improved order. "stats" tells how the search went.
+
+        In the distance-matrix, 0 is the home of the driver, 1 ... n are the stops, and n + 1 is where the route ends,
+        which is at no distance from any stop
+
+"""
+class RouteImprovement :
+
+    def __init__(self, route : list):
+        self.route = route
+        num_stops = len(route)
+        self.end : int = num_stops + 1
+        self.distances = np.zeros((num_stops + 2, num_stops + 2))
+        if num_stops > 0 :
+            locations = [route[0]['from']] + [trip['to'] for trip in route]
+            self.distances[:num_stops + 1, :num_stops + 1] = distance_matrix(to_radians(locations))
+
+        # The stop of the pickup which each delivery depends on (-1 for the pickups themselves)
+        pickup_stop : dict = {}
+        for stop , trip in enumerate(route, start = 1) :
+            if trip.get('type') == 'pickup' :
+                pickup_stop[trip['sellRequest']['name']] = stop
+        self.pickup_of = np.full(num_stops + 2, -1, dtype = np.int64)
+        for stop , trip in enumerate(route, start = 1) :
+            if trip.get('type') != 'pickup' :
+                self.pickup_of[stop] = pickup_stop.get(trip['sellRequest']['name'], -1)
+        self.deliveries = np.nonzero(self.pickup_of >= 0)[0]
+
+        self.order : list = list(range(1, num_stops + 1))
+        self.stats : dict = {
+            'stops'     : num_stops ,
+            'moves'     : 0 ,
+            'before_km' : self.length(self.order) ,
+            'after_km'  : 0.0 ,
+            'seconds'   : 0.0 ,
+            'finished'  : False
+        }
+
+    def _path(self, order : list) -> np.ndarray :
+        return np.array([0] + order + [self.end], dtype = np.int64)
+
+    def length(self, order : list) -> float :
+        path = self._path(order)
+        return float(self.distances[path[:-1], path[1:]].sum())
+
+    """
+        feasible :
+
+        True if every pickup comes before the deliveries of its SellRequest, in the argument order
+    """
+    def feasible(self, order : list) -> bool :
+        if len(self.deliveries) <= 0 :
+            return True
+        position = np.empty(len(self.pickup_of), dtype = np.int64)
+        position[self._path(order)] = np.arange(len(self.pickup_of))
+        return bool(np.all(position[self.pickup_of[self.deliveries]] < position[self.deliveries]))
+
+    """
+        _two_opt_moves :
+
+        The change in length of every 2-opt move on the path, as a matrix : at [i - 1 , j - 1], the change from
+        reversing the stops path[i] ... path[j] (inf where j <= i)
+    """
+    def _two_opt_moves(self, path : np.ndarray) -> np.ndarray :
+        last = len(path) - 2
+        before , first = path[0:last][:, np.newaxis] , path[1:last + 1][:, np.newaxis]
+        stop , after = path[1:last + 1][np.newaxis, :] , path[2:last + 2][np.newaxis, :]
+        change = self.distances[before, stop] + self.distances[first, after] - \
+                 self.distances[before, first] - self.distances[stop, after]
+        return np.where(np.triu(np.ones_like(change, dtype = bool), k = 1), change, np.inf)
+
+    """
+        _segment_moves :
+
+        The change in length of every move of "length" stops on the path, as a matrix : at [i - 1 , k], the change
+        from moving the stops path[i] ... path[i + length - 1] to between path[k] and path[k + 1] (inf where that edge
+        touches the stops moved). Moves of one stop are the relocations, and the longer ones Or-opt
+    """
+    def _segment_moves(self, path : np.ndarray, length : int) -> np.ndarray :
+        starts = np.arange(1, len(path) - length)
+        first , last = path[starts] , path[starts + length - 1]
+        before , after = path[starts - 1] , path[starts + length]
+        removed = self.distances[before, first] + self.distances[last, after] - self.distances[before, after]
+        edge_from , edge_to = path[:-1][np.newaxis, :] , path[1:][np.newaxis, :]
+        inserted = self.distances[edge_from, first[:, np.newaxis]] + self.distances[last[:, np.newaxis], edge_to] - \
+                   self.distances[edge_from, edge_to]
+        edges = np.arange(len(path) - 1)[np.newaxis, :]
+        touching = (edges >= starts[:, np.newaxis] - 1) & (edges <= starts[:, np.newaxis] + length - 1)
+        return np.where(touching, np.inf, inserted - removed[:, np.newaxis])
+
+    """
+        _moves :
+
+        All the moves on the path, as one array of changes in length, and the (length , matrix-width , size) of each
+        kind of move, in the order they were put in the array (2-opt has length 0)
+    """
+    def _moves(self, path : np.ndarray) -> tuple :
+        changes : list = [self._two_opt_moves(path)]
+        kinds : list = [0]
+        for length in range(1, min(MAX_SEGMENT, len(path) - 3) + 1) :
+            changes.append(self._segment_moves(path, length))
+            kinds.append(length)
+        return np.concatenate([change.ravel() for change in changes]) , \
+               [(length , change.shape[1] , change.size) for length , change in zip(kinds, changes)]
+
+    @staticmethod
+    def _moved(path : np.ndarray, kinds : list, at : int) -> list :
+        for length , width , size in kinds :
+            if at < size :
+                break
+            at = at - size
+        row , column = divmod(at, width)
+        stops = path.tolist()
+        if length == 0 :
+            i , j = row + 1 , column + 1
+            stops[i:j + 1] = stops[i:j + 1][::-1]
+        else :
+            i = row + 1
+            segment = stops[i:i + length]
+            edge_from = stops[column]
+            del stops[i:i + length]
+            insert_at = stops.index(edge_from) + 1
+            stops[insert_at:insert_at] = segment
+        return stops[1:-1]
+
+    """
+        improve :
+
+        Shorten the route until no move shortens it any more, or "time_budget" seconds have gone. Returns the order
+    """
+    def improve(self, time_budget : float = ROUTE_TIME_BUDGET_S) -> list :
+        started = time.monotonic()
+        deadline = started + time_budget
+        while time.monotonic() <= deadline :
+            path = self._path(self.order)
+            changes , kinds = self._moves(path)
+            shorter = np.nonzero(changes < -MIN_GAIN_KM)[0]
+            improved = False
+            for at in shorter[np.argsort(changes[shorter], kind = 'stable')] :
+                order = self._moved(path, kinds, int(at))
+                if self.feasible(order) :
+                    self.order = order
+                    self.stats['moves'] = self.stats['moves'] + 1
+                    improved = True
+                    break
+                if time.monotonic() > deadline :
+                    break
+            if not improved :
+                self.stats['finished'] = time.monotonic() <= deadline
+                break
+        self.stats['after_km'] = self.length(self.order)
+        self.stats['seconds'] = time.monotonic() - started
+        return self.order
+
+"""
+    route_in_order :
+
+    The trips of the argument route, with the stops visited in the argument order : each trip goes from the stop
+    before it, and the distances and loads are measured again. A pickup loads what is to be delivered from it in the
+    route
+"""
+def route_in_order(route : list, order : list) -> list :
+    loaded_at : dict = {}
+    for trip in route :
+        if trip.get('type') != 'pickup' :
+            sellRequest_name = trip['sellRequest']['name']
+            loaded_at[sellRequest_name] = loaded_at.get(sellRequest_name, 0) + trip['buyRequest'].get('current_requirement', 0)
+    trips : list = []
+    from_location : dict = route[0]['from']
+    loaded = 0
+    for stop in order :
+        trip : dict = dict(route[stop - 1])
+        trip['from'] = from_location
+        trip['distance'] = distance_cache.distance(from_location, trip['to'])
+        trip['loaded_before'] = loaded
+        if trip.get('type') == 'pickup' :
+            loaded = loaded + loaded_at.get(trip['sellRequest']['name'], 0)
+        else :
+            loaded = loaded - trip['buyRequest'].get('current_requirement', 0)
+        trip['loaded_after'] = loaded
+        trips.append(trip)
+        from_location = trip['to']
+    return trips
+
+"""
+    Function : improve_route
+
+    Description :
+        Shorten the argument route (see RouteImprovement), within "time_budget" seconds. Returns the route, in the
+        same layout, and the stats of the search. A route which could not be shortened is returned as it was
+
+"""
+def improve_route(route : list, time_budget : float = ROUTE_TIME_BUDGET_S) -> tuple :
+    if len(route) < 4 :
+        return route , {'stops' : len(route) , 'moves' : 0}
+    improvement = RouteImprovement(route)
+    order = improvement.improve(time_budget)
+    if improvement.stats['moves'] <= 0 :
+        return route , improvement.stats
+    return route_in_order(route, order) , improvement.stats
@@ -0,0 +1,703 @@
+"""
+    File : snapshot.py
+    Date : 18.10.2026
+    Description :
+
+Contains the in-memory snapshot of a county, which the matching passes in "prepare.py" share during one
+planning iteration, so that every piece of county data is loaded from the graph at most once per iteration
+
+"""
+
+# from standard Python
+import datetime
+
+# from common_library
+from libs.commonlib.defs import *
+from libs.commonlib import graph_funcs
+from libs.commonlib.graph_funcs import get_all_countys , get_buyrequests_with_reservations_in_county , get_buyrequests_without_reservations_in_county , \
+    get_reservations_in_county , get_staged_sells_in_county , get_staged_drives_in_county , \
+    get_sell_requests_in_county , get_drivers_in_county , get_staged_drives_in_county_both_locations , \
+    get_staged_drives_in_county_both_locations_multi , get_pickup_from_driver_home
+
+# from matching_library
+from .geo import CountyGeoIndex
+from .distance_cache import distance_cache
+from .changes import ChangeSet , REQUEST_KINDS
+
+"""
+    The collections which hold requests, and the kind of request in them. When they are loaded, the county of each
+    request is learned by the PlanningIteration
+"""
+NAMED_COLLECTIONS : dict = {
+    'reservation_requests' : 'BuyRequest'   ,
+    'ordinary_requests'    : 'BuyRequest'   ,
+    'sell_requests'        : 'SellRequest'  ,
+    'drivers'              : 'DriveRequest'
+}
+
+"""
+    With stream_buyers, the BuyRequests are read from the graph in pages of this many rows, by the paged variants of
+    the buyer queries in graph_funcs (called with "skip" and "limit" besides the arguments of the full query, and
+    returning the rows in the same, stable order). With a version of graph_funcs which does not have them, the
+    BuyRequests are read by the full query, as one page
+"""
+BUYER_PAGE_SIZE : int = 1000
+PAGED_BUYER_QUERIES : dict = {
+    'reservation_requests' : 'get_buyrequests_with_reservations_in_county_paged'    ,
+    'ordinary_requests'    : 'get_buyrequests_without_reservations_in_county_paged'
+}
+
+"""
+    The collections of a CountySnapshot which are read from the graph as they are (the rest are made from these)
+"""
+LOADED_COLLECTIONS : tuple = ('reservation_requests' , 'ordinary_requests' , 'sell_requests' , 'drivers' ,
+                              'reservations' , 'staged_sells' , 'staged_drives')
+
+"""
+    group_sellers_by_postcode :
+
+    Take the [SellRequest, user, Location] lists of a county (from get_sell_requests_in_county), keep the ones with
+    capacity, and group them by the (string) postcode of their Location
+"""
+def group_sellers_by_postcode(sell_requests : list) -> dict :
+    sellers_in_county: dict = {}
+    for sellreq in sell_requests:
+        if not isinstance(sellreq, list) or len(sellreq) < 3:
+            continue
+        if sellreq[0].get('current_capacity', 0) <= 0:
+            continue
+        postcode: str = str(sellreq[2].get('postcode', '_'))
+        if not postcode in sellers_in_county:
+            sellers_in_county[postcode] = []
+        sellers_in_county[postcode].append(sellreq)
+    return sellers_in_county
+
+"""
+    get_sellers_in_county :
+
+    Retrieve all the sellers available from the argument county, grouped by postcode, in one query
+"""
+def get_sellers_in_county(county : str) :
+    return group_sellers_by_postcode(get_sell_requests_in_county(county))
+
+"""
+    available_to_reserve / available_to_sell :
+
+    How much more a seller (a [SellRequest, user, Location] list) can take on in reservations, and in ordinary sales
+"""
+def available_to_reserve(local_seller : list) -> float :
+    sellRequest = local_seller[0]
+    return sellRequest.get('current_capacity', 0) - sellRequest.get('amount_reserved', 0)
+
+def available_to_sell(local_seller : list) -> float :
+    sellRequest = local_seller[0]
+    return sellRequest.get('current_capacity', 0) - sellRequest.get('amount_reserved', 0) - \
+           sellRequest.get('amount_staged', 0)
+
+"""
+    Class : CountySnapshot
+
+    Description :
+        Everything the matching passes read about one county. Each collection is loaded from the graph the first
+        time it is asked for, and is then kept for the rest of the planning iteration. The node-dicts are shared
+        between the passes, so counter-updates made in memory by one pass (like 'amount_reserved' on a
+        SellRequest) are seen by the passes which comes after it.
+
+        When a pass writes a relationship to the graph, it must also record it here (record_reservation ,
+        record_staged_sell), or invalidate the collection, so that the snapshot never falls behind the graph. The
+        staged drives of the drivers-pass are kept here (record_staged_drive), instead of being loaded again.
+
+        In an incremental iteration, "changes" holds the requests which has changed since the last one, so the passes
+        can re-match those.
+
+        In a dry run, "plan" is the PlanningPlan (see "plan.py") collecting what would be written. Nothing reaches the
+        graph then, so the snapshot itself stands in for the writes : after a planned reset the relationships are
+        read as empty, the counters of the staged sells and drives as zero, and the drivers it releases from
+        quarantine as available, and the routes get their deliveries and pickups from the snapshot and the plan
+        (deliveries_for , pickup_from_driver_home).
+
+        With stream_buyers, the BuyRequests are read from the graph in pages of BUYER_PAGE_SIZE, handed to the passes
+        one at a time (each_buyer), and are not kept in the snapshot afterwards (a pass which asks for them again,
+        reads them again). Together with a ResultCallback (see "matching.py"), the buyers which are not matched are
+        then let go of as the pass goes, so that no more than a page of them is held at once.
+
+"""
+class CountySnapshot :
+
+    def __init__(self, county : str, calc_time : datetime.datetime, changes : ChangeSet = None, county_of : dict = None,
+                 plan = None, stream_buyers : bool = False):
+        self.county = county
+        self.calc_time = calc_time
+        self.changes = changes
+        self.county_of : dict = county_of if county_of is not None else {}
+        self.plan = plan
+        self.recorded_staged_drives : list = None
+        self.removed_drivers : set = set()
+        self.home_pickups : dict = {}
+        self.stream_buyers : bool = stream_buyers
+        self._loaded : dict = {}
+
+    """
+        from_rows :
+
+        A snapshot of the argument county, holding the argument rows instead of what is in the graph, by the name of
+        the collection (see LOADED_COLLECTIONS), like from_rows(county, calc_time, sell_requests = [...]). The rows
+        have the layout of the graph_funcs queries behind the collections. Collections which are not given are still
+        loaded from the graph when asked for. Used for synthetic counties (see "benchmark_assignment.py")
+    """
+    @classmethod
+    def from_rows(cls, county : str, calc_time : datetime.datetime, **collections) :
+        snapshot = cls(county, calc_time)
+        for key , rows in collections.items() :
+            if not key in LOADED_COLLECTIONS :
+                raise Exception('CountySnapshot.from_rows : unknown collection : ' + str(key))
+            snapshot._loaded[key] = snapshot._learn_counties(key, rows)
+        return snapshot
+
+    def _learn_counties(self, key : str, rows : list) -> list :
+        if key in NAMED_COLLECTIONS :
+            for row in rows :
+                if isinstance(row, list) and len(row) > 0 :
+                    self.county_of[row[0].get('name', '_')] = self.county
+        return rows
+
+    def _load(self, key : str, loader) :
+        if not key in self._loaded :
+            self._loaded[key] = self._learn_counties(key, loader())
+        return self._loaded[key]
+
+    """
+        _relationships :
+
+        Load relationships from the graph, unless a planned reset has removed them all
+    """
+    def _relationships(self, loader) -> list :
+        if self.plan is not None and self.plan.reset :
+            return []
+        return loader()
+
+    """
+        _reset_counters :
+
+        A planned reset also sets the argument counters back to zero on every node, so the rows are read with the
+        counters at zero, like they are in the graph after the reset
+    """
+    def _reset_counters(self, rows : list, counters : tuple) -> list :
+        if self.plan is not None and self.plan.reset :
+            for row in rows :
+                if isinstance(row, list) and len(row) > 0 :
+                    for counter in counters :
+                        row[0][counter] = 0
+        return rows
+
+    def invalidate(self, *keys) :
+        for key in keys :
+            self._loaded.pop(key, None)
+            if key == 'sell_requests' :
+                self.invalidate('sellers_by_postcode')
+            elif key == 'sellers_by_postcode' :
+                self.invalidate('sellers_by_name', 'reservable_index', 'sale_index')
+            elif key == 'drivers_by_postcode' :
+                self.invalidate('driver_index')
+            elif key in ('reservations' , 'staged_sells') :
+                self.invalidate('deliveries_by_sellRequest')
+            elif key == 'staged_drives_both_locations' :
+                self.invalidate('drivers_by_seller')
+
+    """
+        sellers_by_postcode :
+
+        The sellers with capacity, grouped by (string) postcode, like get_sellers_in_county. It is made from
+        sell_requests, so the drivers-pass gets its SellRequests from the same query, and the same node-dicts
+    """
+    @property
+    def sellers_by_postcode(self) -> dict :
+        return self._load('sellers_by_postcode', lambda : group_sellers_by_postcode(self.sell_requests))
+
+    """
+        sellers_by_name :
+
+        The same sellers as in sellers_by_postcode, by the name of their SellRequest
+    """
+    @property
+    def sellers_by_name(self) -> dict :
+        def index_by_name() -> dict :
+            sellers_by_name : dict = {}
+            for postcode , local_sellers in self.sellers_by_postcode.items() :
+                for local_seller in local_sellers :
+                    if isinstance(local_seller, list) and len(local_seller) >= 3 :
+                        sellers_by_name.setdefault(local_seller[0].get('name', '_'), local_seller)
+            return sellers_by_name
+        return self._load('sellers_by_name', index_by_name)
+
+    def seller_named(self, sellRequest_name : str) :
+        return self.sellers_by_name.get(sellRequest_name)
+
+    """
+        reservation_requests / ordinary_requests :
+
+        The BuyRequests with and without reservations, which has not been claimed by a driver yet AND
+        that has not yet been served within the minimum-age
+    """
+    @property
+    def reservation_requests(self) -> list :
+        return self._load('reservation_requests', self._buyer_loader('reservation_requests'))
+
+    @property
+    def ordinary_requests(self) -> list :
+        return self._load('ordinary_requests', self._buyer_loader('ordinary_requests'))
+
+    def _buyer_loader(self, key : str) :
+        graph_query = get_buyrequests_with_reservations_in_county if key == 'reservation_requests' else \
+            get_buyrequests_without_reservations_in_county
+        return lambda : graph_query(
+            county            = self.county    ,
+            minimum_age       = FIVE_DAYS      ,
+            calc_time         = self.calc_time ,
+            claimed_by_driver = False
+        )
+
+    """
+        _buyer_pages :
+
+        The rows of reservation_requests or ordinary_requests (by "key"), read from the graph a page at a time (see
+        BUYER_PAGE_SIZE)
+    """
+    def _buyer_pages(self, key : str) :
+        paged_query = getattr(graph_funcs, PAGED_BUYER_QUERIES[key], None)
+        if paged_query is None :
+            yield self._learn_counties(key, self._buyer_loader(key)())
+            return
+        skip : int = 0
+        while True :
+            page : list = self._learn_counties(key, paged_query(
+                county            = self.county     ,
+                minimum_age       = FIVE_DAYS       ,
+                calc_time         = self.calc_time  ,
+                claimed_by_driver = False           ,
+                skip              = skip            ,
+                limit             = BUYER_PAGE_SIZE
+            ))
+            read : int = len(page)
+            if read > 0 :
+                yield page
+            if read < BUYER_PAGE_SIZE :
+                return
+            skip = skip + read
+
+    """
+        each_buyer :
+
+        The rows of reservation_requests or ordinary_requests (by "key"), one at a time. With stream_buyers (and
+        unless the collection is already kept), the rows are read a page at a time, and each row is let go of as
+        soon as it has been handed out, so rows the pass does not keep are freed while the pass runs
+    """
+    def each_buyer(self, key : str) :
+        if not self.stream_buyers or key in self._loaded :
+            for row in self._load(key, self._buyer_loader(key)) :
+                yield row
+            return
+        for rows in self._buyer_pages(key) :
+            rows.reverse()
+            while rows :
+                yield rows.pop()
+
+    """
+        requested_buyers :
+
+        The BuyRequests of reservation_requests or ordinary_requests (by "key"), by name, only of the argument
+        "names" if given. With stream_buyers, the rows are read a page at a time, and only the BuyRequests asked for
+        are kept
+    """
+    def requested_buyers(self, key : str, names = None) -> dict :
+        if not self.stream_buyers or key in self._loaded :
+            pages = [self._load(key, self._buyer_loader(key))]
+        else :
+            pages = self._buyer_pages(key)
+        return {row[0].get('name', '_') : row[0] for rows in pages for row in rows
+                if names is None or row[0].get('name', '_') in names}
+
+    @property
+    def reservations(self) -> list :
+        return self._load('reservations', lambda : self._relationships(lambda : get_reservations_in_county(self.county)))
+
+    @property
+    def staged_sells(self) -> list :
+        return self._load('staged_sells', lambda : self._relationships(lambda : get_staged_sells_in_county(self.county)))
+
+    @property
+    def staged_drives(self) -> list :
+        return self._load('staged_drives', lambda : self._relationships(lambda : get_staged_drives_in_county(self.county)))
+
+    @property
+    def sell_requests(self) -> list :
+        return self._load('sell_requests', lambda : self._reset_counters(get_sell_requests_in_county(self.county),
+                                                                          ('num_staged' , 'amount_staged')))
+
+    @property
+    def drivers(self) -> list :
+        def load_drivers() -> list :
+            drivers = get_drivers_in_county(self.county)
+            if self.plan is not None and self.plan.released_drivers :
+                for local_driver in get_drivers_in_county(self.county, False) :
+                    driveRequest = local_driver[0]
+                    if driveRequest.get('name', '_') in self.plan.released_drivers :
+                        if 'available' in driveRequest :
+                            driveRequest['available'] = True
+                        driveRequest['available_again_time'] = 0
+                        drivers.append(local_driver)
+            for local_driver in drivers :
+                if isinstance(local_driver, list) and local_driver[0].get('name', '_') in self.removed_drivers :
+                    local_driver[0]['num_staged_pickups'] = 0
+            return self._reset_counters(drivers, ('num_staged_pickups' ,))
+        return self._load('drivers', load_drivers)
+
+    """
+        drivers_by_postcode :
+
+        The available drivers, grouped by (string) postcode of their location
+    """
+    @property
+    def drivers_by_postcode(self) -> dict :
+        def group_drivers() -> dict :
+            drivers_in_county_dict: dict = {}
+            for slrc in self.drivers:
+                if len(slrc) < 3:
+                    continue
+                postcode: str = str(slrc[2].get('postcode', '_'))
+                if not postcode in drivers_in_county_dict:
+                    drivers_in_county_dict[postcode] = []
+                drivers_in_county_dict[postcode].append(slrc)
+            return drivers_in_county_dict
+        return self._load('drivers_by_postcode', group_drivers)
+
+    """
+        reservable_index / sale_index / driver_index :
+
+        Geographic indexes (see "geo.py") over the sellers and drivers, built the first time they are needed. The
+        sellers are ordered by how many reservations (or staged sales) they already have, and the drivers by how
+        many pickups they already have. Ties in distance are measured with the distance cache, so they are resolved
+        like a scan through every seller and driver would. Call refresh_seller / refresh_driver after changing those
+        counters
+    """
+    @property
+    def reservable_index(self) -> CountyGeoIndex :
+        return self._load('reservable_index', lambda : CountyGeoIndex(
+            self.sellers_by_postcode ,
+            capacity_of = available_to_reserve ,
+            load_of     = lambda local_seller : local_seller[0].get('num_reserved', 0) ,
+            distance    = distance_cache.distance
+        ))
+
+    @property
+    def sale_index(self) -> CountyGeoIndex :
+        return self._load('sale_index', lambda : CountyGeoIndex(
+            self.sellers_by_postcode ,
+            capacity_of = available_to_sell ,
+            load_of     = lambda local_seller : local_seller[0].get('num_staged', 0) ,
+            distance    = distance_cache.distance
+        ))
+
+    @property
+    def driver_index(self) -> CountyGeoIndex :
+        return self._load('driver_index', lambda : CountyGeoIndex(
+            self.drivers_by_postcode ,
+            load_of  = lambda local_driver : local_driver[0].get('num_staged_pickups', 0) ,
+            distance = distance_cache.distance
+        ))
+
+    def refresh_seller(self, sellRequest_name : str) :
+        for key in ('reservable_index', 'sale_index') :
+            if key in self._loaded :
+                self._loaded[key].refresh(sellRequest_name)
+
+    def refresh_driver(self, driveRequest_name : str) :
+        if 'driver_index' in self._loaded :
+            self._loaded['driver_index'].refresh(driveRequest_name)
+
+    """
+        staged_drives_both_locations :
+
+        Both the ordinary staged drives and the ones where the driver is also the seller ("multi")
+    """
+    @property
+    def staged_drives_both_locations(self) -> list :
+        def load_both() -> list :
+            if self.recorded_staged_drives is not None :
+                return self._recorded_drives_both_locations()
+            sell_to_driver_assigns = self._relationships(lambda : get_staged_drives_in_county_both_locations(self.county))
+            sell_to_driver_assigns.extend(self._relationships(lambda : get_staged_drives_in_county_both_locations_multi(self.county)))
+            return sell_to_driver_assigns
+        return self._load('staged_drives_both_locations', load_both)
+
+    """
+        sellers_by_driver :
+
+        The SellRequests each driver picks up from, by the name of the DriveRequest, along with the name of the home
+        of the driver : {driveRequest-name : (Location-name , set of SellRequest-names)}
+    """
+    def sellers_by_driver(self) -> dict :
+        sellers : dict = {}
+        for row in self.staged_drives_both_locations :
+            if len(row) < 4 :
+                continue
+            drive_location = row[5] if len(row) >= 6 else row[0]
+            driver_sellers = sellers.setdefault(row[3].get('name', '_'), (drive_location.get('name', '_'), set()))
+            driver_sellers[1].add(row[2].get('name', '_'))
+        return sellers
+
+    """
+        drivers_by_seller :
+
+        The driver which picks up from each SellRequest, by the name of the SellRequest, along with the name of the
+        home of the driver : {sellRequest-name : (DriveRequest-name , Location-name)}
+    """
+    @property
+    def drivers_by_seller(self) -> dict :
+        def by_seller() -> dict :
+            drivers : dict = {}
+            for driveRequest_name , (home_name , sellRequest_names) in self.sellers_by_driver().items() :
+                for sellRequest_name in sellRequest_names :
+                    drivers[sellRequest_name] = (driveRequest_name, home_name)
+            return drivers
+        return self._load('drivers_by_seller', by_seller)
+
+    """
+        _recorded_drives_both_locations :
+
+        The staged drives recorded by the drivers-pass, in the layout of staged_drives_both_locations : first the
+        ordinary ones, then the ones where the driver is also the seller
+    """
+    def _recorded_drives_both_locations(self) -> list :
+        ordinary : list = []
+        multi : list = []
+        for local_driver , local_seller in self.recorded_staged_drives :
+            sellRequest , sell_user , sell_location = local_seller[:3]
+            driveRequest , drive_user , drive_location = local_driver[:3]
+            if sell_user.get('name') == drive_user.get('name') :
+                multi.append([sell_location, sell_user, sellRequest, driveRequest])
+            else :
+                ordinary.append([sell_location, sell_user, sellRequest, driveRequest, drive_user, drive_location])
+        return ordinary + multi
+
+    """
+        deliveries_by_sellRequest :
+
+        The staged sells and reservations of the county, grouped by the name of their SellRequest (the staged sells
+        first), in the layout of get_staged_sells_for_sellreq and get_reservations_for_sellreq. They are made from the
+        staged_sells and reservations of the snapshot, so the routes of a whole county need no more than those two
+        queries, and none at all after the sales passes
+    """
+    @property
+    def deliveries_by_sellRequest(self) -> dict :
+        def group_deliveries() -> dict :
+            grouped : dict = {}
+            for row in self.staged_sells + self.reservations :
+                if len(row) >= 5 :
+                    grouped.setdefault(row[4].get('name', '_'), []).append(row)
+            return grouped
+        return self._load('deliveries_by_sellRequest', group_deliveries)
+
+    """
+        deliveries_for :
+
+        The staged sells and reservations of a SellRequest, to be delivered from it. In a dry run, the BuyRequests are
+        as the plan would leave them
+    """
+    def deliveries_for(self, sellRequest_name : str) -> list :
+        all_deliveries : list = self.deliveries_by_sellRequest.get(sellRequest_name, [])
+        if self.plan is None :
+            return list(all_deliveries)
+        return [[self.plan.as_written(row[0]), *row[1:]] for row in all_deliveries]
+
+    """
+        pickup_from_driver_home / record_pickups :
+
+        True if a route already goes to a pickup from the argument Location (the home of a driver). The graph is
+        asked once per Location, and the answers are kept for the rest of the iteration. The travels of the routes
+        made in the iteration are told with record_pickups
+    """
+    def pickup_from_driver_home(self, location_name : str) -> bool :
+        if self.plan is not None :
+            if self.plan.has_pickup_from(location_name) :
+                return True
+            if self.plan.reset :
+                return False
+        if not location_name in self.home_pickups :
+            already_pickup = get_pickup_from_driver_home(location_name)
+            self.home_pickups[location_name] = bool(already_pickup and len(already_pickup) > 0)
+        return self.home_pickups[location_name]
+
+    def record_pickups(self, travels : list) :
+        for travel_name , from_name , _ , _ in travels :
+            if travel_name == 'TRAVEL_TO_PICKUP' :
+                self.home_pickups[from_name] = True
+
+    """
+        forget_pickups :
+
+        The route from the argument Location (the home of a driver) is to be removed from the graph, so there is no
+        pickup from it any more
+    """
+    def forget_pickups(self, location_name : str) :
+        self.home_pickups[location_name] = False
+
+    """
+        record_reservation / record_staged_sell :
+
+        Keep the snapshot in line with a relationship which was just written to the graph. The rows have the same
+        layout as the rows from get_reservations_in_county and get_staged_sells_in_county
+    """
+    def record_reservation(self, reservation_request : list , relationship_meta : dict, sellRequest : dict) :
+        self.reservations.append([*reservation_request[:3], relationship_meta, sellRequest])
+        self.invalidate('deliveries_by_sellRequest')
+
+    def record_staged_sell(self, sell_request : list , relationship_meta : dict, sellRequest : dict) :
+        self.staged_sells.append([*sell_request[:3], relationship_meta, sellRequest])
+        self.invalidate('deliveries_by_sellRequest')
+
+    """
+        forget_reservations / forget_staged_sells :
+
+        Drop the rows of the argument BuyRequests, after their relationships has been removed from the graph
+    """
+    def forget_reservations(self, buyRequest_names) :
+        self.reservations[:] = [row for row in self.reservations if not row[0].get('name', '_') in buyRequest_names]
+        self.invalidate('deliveries_by_sellRequest')
+
+    def forget_staged_sells(self, buyRequest_names) :
+        self.staged_sells[:] = [row for row in self.staged_sells if not row[0].get('name', '_') in buyRequest_names]
+        self.invalidate('deliveries_by_sellRequest')
+
+    """
+        forget_staged_drives / record_staged_drive :
+
+        The STAGED_DRIVER relationships of the county are to be removed, and the drivers assigned again. The removal
+        is only collected (see assign_drivers_in_county in "matching.py"), so the staged drives are kept here instead
+        of being loaded again (with the DriveRequest first in the rows of staged_drives, like
+        get_staged_drives_in_county), and the pickup-counts of the removed drivers are set back in memory, like
+        remove_staged_driver does in the graph
+    """
+    def forget_staged_drives(self) :
+        self.removed_drivers.update(row[0].get('name', '_') for row in self.staged_drives if len(row) > 0)
+        self._loaded['staged_drives'] = []
+        self.recorded_staged_drives = []
+        self.invalidate('staged_drives_both_locations')
+        if 'drivers' in self._loaded :
+            for local_driver in self.drivers :
+                if isinstance(local_driver, list) and local_driver[0].get('name', '_') in self.removed_drivers :
+                    local_driver[0]['num_staged_pickups'] = 0
+                    self.refresh_driver(local_driver[0]['name'])
+
+    def record_staged_drive(self, local_driver : list, local_seller : list) :
+        if self.recorded_staged_drives is not None :
+            self.recorded_staged_drives.append((local_driver, local_seller))
+            self.staged_drives.append([local_driver[0]])
+            self.invalidate('staged_drives_both_locations')
+
+    """
+        existing_relationships :
+
+        What the graph holds now of the argument kind of relationship ('reservation' , 'staged_sell' or
+        'staged_drive'), for the write-buffers to compare their writes with (see expect in "graph_writes.py") : the
+        relationships as (from-name , to-name , relationship_meta), and the counters kept along with them, by counter
+        and node-name
+    """
+    def existing_relationships(self, kind : str) -> tuple :
+        if kind == 'reservation' :
+            rows , counters , nodes = self.reservations , ('num_reserved' , 'amount_reserved') , self.sell_requests
+        elif kind == 'staged_sell' :
+            rows , counters , nodes = self.staged_sells , ('num_staged' , 'amount_staged') , self.sell_requests
+        elif kind == 'staged_drive' :
+            relationships = [(row[3].get('name', '_'), row[2].get('name', '_'), {})
+                             for row in self.staged_drives_both_locations if len(row) >= 4]
+            counters = {'num_staged_pickups' : {}}
+            for local_driver in self.drivers :
+                if isinstance(local_driver, list) and 'num_staged_pickups' in local_driver[0] :
+                    counters['num_staged_pickups'][local_driver[0]['name']] = local_driver[0]['num_staged_pickups']
+            return relationships , counters
+        else :
+            return [] , {}
+        relationships = [(row[0].get('name', '_'), row[4].get('name', '_'), row[3]) for row in rows if len(row) >= 5]
+        values : dict = {counter : {} for counter in counters}
+        for local_seller in nodes :
+            for counter in counters :
+                if counter in local_seller[0] :
+                    values[counter][local_seller[0]['name']] = local_seller[0][counter]
+        return relationships , values
+
+"""
+    Class : PlanningIteration
+
+    Description :
+        One planning iteration over all counties. Create one of these, and hand it to each of the organize_* functions
+        in "prepare.py", so that they all share the same CountySnapshot per county.
+
+        For an incremental iteration, give it the ChangeSet since the last iteration, and the last iteration itself
+        ("previous"). The passes then only visit the counties where something they depend on has changed. The
+        iteration knows the county of every request it, or its worker-processes, has loaded, and hands that on to the
+        next one, so that changes recorded without a county can be placed. A change which can not be placed makes the
+        passes visit every county. "num_incremental" counts the incremental iterations since the last full one.
+
+        With reset_graph, the planning graph is reset before the first pass of the iteration, so that everything is
+        matched again (see reset_for_iteration in "prepare.py"). Without a calc_time, the time it is created is used.
+
+        With a "plan" (a PlanningPlan, see "plan.py"), the iteration is a dry run : the passes collect their writes in
+        the plan, instead of writing them to the graph. With stream_buyers, the snapshots stream their BuyRequests
+        (see CountySnapshot).
+
+"""
+class PlanningIteration :
+
+    def __init__(self, calc_time : datetime.datetime = None, changes : ChangeSet = None,
+                 previous = None, plan = None, stream_buyers : bool = False, reset_graph : bool = False):
+        if not calc_time :
+            calc_time = datetime.datetime.utcnow()
+        self.calc_time = calc_time
+        self.changes = changes
+        self.reset_graph : bool = reset_graph
+        self.plan = plan
+        self.stream_buyers : bool = stream_buyers
+        self.county_of : dict = dict(previous.county_of) if previous else {}
+        self.num_incremental : int = previous.num_incremental + 1 if previous and changes is not None else 0
+        self._county_names : list = None
+        self._snapshots : dict = {}
+
+    @property
+    def county_names(self) -> list :
+        if self._county_names is None :
+            self._county_names = [county_at[0]['name'] for county_at in get_all_countys()]
+        return self._county_names
+
+    def snapshot(self, county : str) -> CountySnapshot :
+        if not county in self._snapshots :
+            self._snapshots[county] = CountySnapshot(county, self.calc_time, self.changes, self.county_of, self.plan,
+                                                     self.stream_buyers)
+        return self._snapshots[county]
+
+    """
+        dirty_county_names :
+
+        The counties which has a change of one of the argument kinds of request, in the order of county_names. All of
+        them, when the iteration is not incremental
+    """
+    def dirty_county_names(self, kinds : tuple = REQUEST_KINDS) -> list :
+        if self.changes is None :
+            return self.county_names
+        dirty = self.changes.dirty_counties(kinds, self.county_of)
+        if dirty is None :
+            return self.county_names
+        return [county for county in self.county_names if county in dirty]
+
+    def snapshots(self, kinds : tuple = REQUEST_KINDS) :
+        for county in self.dirty_county_names(kinds) :
+            yield self.snapshot(county)
+
+    """
+        discard :
+
+        Forget what was loaded for the county, so that it is loaded from the graph again the next time it is needed.
+        Used when the county was matched somewhere else (like in a worker-process)
+    """
+    def discard(self, county : str) :
+        self._snapshots.pop(county, None)
@@ -0,0 +1,64 @@
+"""
+    File : test_assignment.py
+    Date : 18.10.2026
+    Description :
+
+Checks of the MinCostFlowAssignment in "assignment.py", on small random instances : no seller is given more than its
+capacity, and every buyer gets at most one seller.
+
+"""
+
+# from standard Python
+import random
+
+# other stuff
+import pytest
+
+# from matching_library
+from ..geo import to_radians
+from ..assignment import MinCostFlowAssignment
+
+"""
+    make_instance :
+
+    Random buyers and sellers around one point, with a total capacity of "slack" times the total demand
+"""
+def make_instance(num_buyers : int, num_sellers : int, slack : float, seed : int) -> tuple :
+    rnd = random.Random(seed)
+    def location() -> dict :
+        return {'lat' : 59.5 + rnd.gauss(0.0, 0.1) , 'lon' : 10.5 + rnd.gauss(0.0, 0.2)}
+    demands : list = [rnd.randint(1, 8) for _ in range(num_buyers)]
+    weights : list = [rnd.uniform(0.2, 1.8) for _ in range(num_sellers)]
+    capacities : list = [int(slack * sum(demands) * weight / sum(weights)) for weight in weights]
+    buyers : list = [location() for _ in range(num_buyers)]
+    sellers : list = [location() for _ in range(num_sellers)]
+    return to_radians(buyers) , demands , to_radians(sellers) , capacities
+
+@pytest.mark.parametrize('seed', range(8))
+@pytest.mark.parametrize('slack', [0.5, 1.0, 1.5])
+def test_capacity_is_never_exceeded(seed : int, slack : float) :
+    buyer_coordinates , demands , seller_coordinates , capacities = make_instance(300, 12, slack, seed)
+    assignment = MinCostFlowAssignment(buyer_coordinates, demands, seller_coordinates, capacities)
+    assigned = assignment.solve()
+
+    assert len(assigned) == len(demands)
+    loads : list = [0] * len(capacities)
+    for buyer , seller in enumerate(assigned) :
+        assert -1 <= seller < len(capacities)
+        if seller >= 0 :
+            loads[seller] = loads[seller] + demands[buyer]
+    for load , capacity in zip(loads, capacities) :
+        assert load <= capacity
+    assert assignment.stats['unassigned'] == assigned.count(-1)
+
+def test_every_buyer_is_placed_when_there_is_room() :
+    buyer_coordinates , demands , seller_coordinates , capacities = make_instance(200, 10, 2.0, 1)
+    # Room for everyone with every seller : even the largest seller-share is more than the largest demand
+    capacities = [max(capacity, sum(demands)) for capacity in capacities]
+    assigned = MinCostFlowAssignment(buyer_coordinates, demands, seller_coordinates, capacities).solve()
+    assert assigned.count(-1) == 0
+
+def test_buyers_larger_than_every_seller_are_not_placed() :
+    buyer_coordinates , _ , seller_coordinates , _ = make_instance(20, 3, 1.0, 2)
+    assigned = MinCostFlowAssignment(buyer_coordinates, [10] * 20, seller_coordinates, [5 , 5 , 5]).solve()
+    assert assigned == [-1] * 20
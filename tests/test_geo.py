@@ -0,0 +1,169 @@
+"""
+    File : test_geo.py
+    Date : 18.10.2026
+    Description :
+
+Checks of the geographic indexes in "geo.py" against a scan through every candidate, like the finders and the delivery
+ordering did before the indexes : on random counties, with the coordinates rounded to a grid, so that there are many
+candidates at the same distance, the indexes must choose the same sellers, drivers and deliveries, in the same order.
+
+"""
+
+# from standard Python
+import copy
+import math
+import random
+
+# other stuff
+import pytest
+
+# from matching_library
+from ..geo import CountyGeoIndex , distance_matrix , distances_from , nearest_neighbour_order , to_radians
+
+GRID_DEGREES : float = 0.01
+
+"""
+    haversine :
+
+    The distance (km) between two Locations, measured like distance_between_coordinates in commonlib
+"""
+def haversine(location_a : dict, location_b : dict) -> float :
+    lat_a , lon_a = math.radians(location_a['lat']) , math.radians(location_a['lon'])
+    lat_b , lon_b = math.radians(location_b['lat']) , math.radians(location_b['lon'])
+    h = math.sin((lat_b - lat_a) / 2) ** 2 + math.cos(lat_a) * math.cos(lat_b) * math.sin((lon_b - lon_a) / 2) ** 2
+    return 2 * 6371.0 * math.asin(math.sqrt(h))
+
+"""
+    make_county :
+
+    Random sellers (as [SellRequest, user, Location] lists, grouped by postcode) and buyers (as (Location , demand))
+    around the centres of a few postcodes
+"""
+def make_county(seed : int) -> tuple :
+    rnd = random.Random(seed)
+    postcodes : list = [str(1000 + number) for number in range(rnd.randint(2, 6))]
+    centres : dict = {postcode : (59.0 + rnd.uniform(-0.3, 0.3), 10.0 + rnd.uniform(-0.5, 0.5))
+                      for postcode in postcodes}
+    def location(postcode : str) -> dict :
+        lat , lon = centres[postcode]
+        return {
+            'lat'      : round((lat + rnd.gauss(0.0, 0.03)) / GRID_DEGREES) * GRID_DEGREES ,
+            'lon'      : round((lon + rnd.gauss(0.0, 0.05)) / GRID_DEGREES) * GRID_DEGREES ,
+            'postcode' : postcode
+        }
+    sellers_by_postcode : dict = {}
+    for number in range(rnd.randint(5, 40)) :
+        postcode = rnd.choice(postcodes)
+        sellRequest : dict = {'name' : 'sell' + str(number) , 'capacity' : rnd.randint(1, 30) , 'load' : 0}
+        sellers_by_postcode.setdefault(postcode, []).append([sellRequest, {}, location(postcode)])
+    buyers : list = []
+    for _ in range(200) :
+        buyers.append((location(rnd.choice(postcodes)), rnd.randint(1, 6)))
+    return sellers_by_postcode , buyers
+
+"""
+    scan :
+
+    The seller the finders chose by measuring every candidate : the ones with capacity for "need" and the lowest load
+    first, then the nearest of those, and ties by the order of the sellers
+"""
+def scan(sellers_by_postcode : dict, postcodes : list, location : dict, need : float) :
+    candidates : list = [local_seller for postcode in postcodes
+                         for local_seller in sellers_by_postcode.get(postcode, [])
+                         if local_seller[0]['capacity'] >= need]
+    if len(candidates) <= 0 :
+        return None
+    lowest_load = min(local_seller[0]['load'] for local_seller in candidates)
+    candidates = [local_seller for local_seller in candidates if local_seller[0]['load'] == lowest_load]
+    return sorted(candidates, key = lambda local_seller : haversine(local_seller[2], location))[0]
+
+"""
+    match_all :
+
+    Give each buyer a seller, within its own postcode if possible, or else anywhere in the county, and count it at
+    the seller. Returns the names of the chosen sellers, in the order of the buyers
+"""
+def match_all(buyers : list, find_in_postcode , find_in_county , refresh = None) -> list :
+    chosen : list = []
+    for location , need in buyers :
+        local_seller = find_in_postcode(location, need) or find_in_county(location, need)
+        chosen.append(local_seller[0]['name'] if local_seller else None)
+        if local_seller :
+            local_seller[0]['capacity'] = local_seller[0]['capacity'] - need
+            local_seller[0]['load'] = local_seller[0]['load'] + 1
+            if refresh :
+                refresh(local_seller[0]['name'])
+    return chosen
+
+@pytest.mark.parametrize('seed', range(40))
+def test_sellers_are_chosen_as_by_a_scan(seed : int) :
+    sellers_by_postcode , buyers = make_county(seed)
+    scanned = copy.deepcopy(sellers_by_postcode)
+    indexed = copy.deepcopy(sellers_by_postcode)
+    index = CountyGeoIndex(indexed, capacity_of = lambda local_seller : local_seller[0]['capacity'],
+                           load_of = lambda local_seller : local_seller[0]['load'], distance = haversine)
+
+    expected = match_all(buyers,
+                         lambda location , need : scan(scanned, [location['postcode']], location, need),
+                         lambda location , need : scan(scanned, list(scanned.keys()), location, need))
+    found = match_all(buyers,
+                      lambda location , need : index.nearest_in_postcode(location['postcode'], location, need),
+                      lambda location , need : index.nearest(location, need), index.refresh)
+    assert found == expected
+
+@pytest.mark.parametrize('seed', range(40))
+def test_drivers_are_chosen_as_by_a_scan(seed : int) :
+    drivers_by_postcode , sellers = make_county(seed)
+    scanned = copy.deepcopy(drivers_by_postcode)
+    indexed = copy.deepcopy(drivers_by_postcode)
+    index = CountyGeoIndex(indexed, load_of = lambda local_driver : local_driver[0]['load'], distance = haversine)
+
+    expected = match_all(sellers,
+                         lambda location , _ : scan(scanned, [location['postcode']], location, -math.inf),
+                         lambda location , _ : scan(scanned, list(scanned.keys()), location, -math.inf))
+    found = match_all(sellers,
+                      lambda location , _ : index.nearest_in_postcode(location['postcode'], location),
+                      lambda location , _ : index.nearest(location), index.refresh)
+    assert found == expected
+
+@pytest.mark.parametrize('seed', range(40))
+def test_deliveries_are_ordered_as_by_a_scan(seed : int) :
+    rnd = random.Random(seed)
+    _ , buyers = make_county(seed)
+    deliveries : list = [[{'name' : 'buy' + str(rnd.randint(0, 60))}, {}, location]
+                         for location , _ in buyers[:rnd.randint(1, 120)]]
+    start = buyers[-1][0]
+
+    expected : list = []
+    left : list = list(range(len(deliveries)))
+    at = start
+    while left :
+        nearest = sorted(left, key = lambda position : haversine(deliveries[position][2], at))[0]
+        expected.append(nearest)
+        at = deliveries[nearest][2]
+        left = [position for position in left if deliveries[position][0]['name'] != deliveries[nearest][0]['name']]
+
+    assert list(nearest_neighbour_order(start, deliveries, distance = haversine)) == expected
+
+def test_batched_distances_measure_like_commonlib() :
+    location_funcs = pytest.importorskip('libs.commonlib.location_funcs')
+    _ , buyers = make_county(7)
+    locations : list = [location for location , _ in buyers[:50]]
+    coordinates = to_radians(locations)
+    matrix = distance_matrix(coordinates)
+    for row , origin in enumerate(locations) :
+        expected = [location_funcs.distance_between_coordinates(origin, location) for location in locations]
+        assert distances_from(origin, coordinates).tolist() == pytest.approx(expected, rel = 1e-9, abs = 1e-9)
+        assert matrix[row].tolist() == pytest.approx(expected, rel = 1e-9, abs = 1e-9)
+
+def test_ties_are_measured_with_the_distance_function() :
+    location : dict = {'lat' : 59.0 , 'lon' : 10.0 , 'postcode' : '1000'}
+    west : list = [{'name' : 'west'}, {}, {'lat' : 59.0 , 'lon' : 9.99 , 'postcode' : '1000'}]
+    east : list = [{'name' : 'east'}, {}, {'lat' : 59.0 , 'lon' : 10.01 , 'postcode' : '1001'}]
+
+    # Without a distance function, the first of the (equally near) entries is chosen
+    assert CountyGeoIndex({'1000' : [west] , '1001' : [east]}).nearest(location)[0]['name'] == 'west'
+    # With one, the nearest by that function, even when the difference is far below the precision of the index
+    prefer_east = lambda entry_location , _ : 1.0 if entry_location['lon'] < 10.0 else 1.0 - 1e-12
+    index = CountyGeoIndex({'1000' : [west] , '1001' : [east]}, distance = prefer_east)
+    assert index.nearest(location)[0]['name'] == 'east'